@@ -2,13 +2,16 @@ import os
 import cv2
 import time
 import logging
-import re
 from flask import Flask, render_template, Response, request, jsonify, send_from_directory
 from flask_socketio import SocketIO
 from dotenv import load_dotenv
-from threading import Thread
+from threading import Thread, Lock
 import traceback  # Ensure traceback is imported
-import numpy as np  # Add numpy import for imdecode
+import uuid
+import socket
+import sys
+import atexit
+import signal
 
 # Load environment variables
 load_dotenv()
@@ -21,8 +24,19 @@ os.makedirs('captured_images', exist_ok=True)
 from modules.camera import Camera
 from modules.vision_api import VisionAPI
 from modules.text_to_speech import TextToSpeech
+from modules.tts_process import IsolatedTextToSpeech
+from modules.tts_pool import TextToSpeechPool
+from modules.audio_cache import AudioCache
+from modules.audio_delivery import AudioDelivery
 from modules.drawing_analyzer import DrawingAnalyzer
 from modules.vertex_imagen import VertexImagen
+from modules.reference_jobs import ReferenceJobManager, QueueFullError
+from modules.latest_wins import LatestWinsExecutor
+from modules.prompt_prefetcher import PromptPrefetcher
+from modules.startup import StartupOrchestrator
+from modules.thumbnails import ThumbnailCache
+from modules.insight_analytics import InsightAnalytics
+from modules.session_context import SessionContext
 
 # Configure logging
 logging.basicConfig(
@@ -40,56 +54,151 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'default_secret_key')
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Initialize components
-try:
-    api_key = os.getenv('VISION_API_KEY')
-    api_url = os.getenv('VISION_API_URL')
-    system_prompt = os.getenv('VISION_SYSTEM_PROMPT',
-        "You are an expert comic book art assistant. Analyze the user's drawing and provide helpful, constructive, and actionable feedback to improve their comic art technique. Focus on clarity, anatomy, perspective, and storytelling. Be concise and supportive."
-    )
-    logger.info(f"Using Vision API key: {api_key[:8]}... (truncated for security)")
-    logger.info(f"Using Vision API URL: {api_url}")
-    logger.info(f"Using Vision system prompt: {system_prompt[:60]}...")
-
-    camera = Camera()
-    vision_api = VisionAPI(
-        api_key=api_key,
-        api_url=api_url,
-        system_prompt=system_prompt
+# Initialize components concurrently; the server starts once the critical ones are up
+api_key = os.getenv('VISION_API_KEY')
+api_url = os.getenv('VISION_API_URL')
+system_prompt = os.getenv('VISION_SYSTEM_PROMPT',
+    "You are an expert comic book art assistant. Analyze the user's drawing and provide helpful, constructive, and actionable feedback to improve their comic art technique. Focus on clarity, anatomy, perspective, and storytelling. Be concise and supportive."
+)
+logger.info(f"Using Vision API key: {(api_key or '')[:8]}... (truncated for security)")
+logger.info(f"Using Vision API URL: {api_url}")
+logger.info(f"Using Vision system prompt: {system_prompt[:60]}...")
+
+def create_imagen_client():
+    client = VertexImagen()  # Vertex Imagen client; the SDK loads in the background
+    client.start_warmup()
+    return client
+
+def create_tts():
+    cache_enabled = os.getenv('TTS_AUDIO_CACHE', 'false').lower() == 'true'
+    cache_dir = os.getenv('TTS_AUDIO_CACHE_DIR', 'tts_cache')
+    cache_bytes = int(float(os.getenv('TTS_AUDIO_CACHE_MB', '100')) * 1024 * 1024)
+    browser_engines = int(os.getenv('TTS_BROWSER_ENGINES', '2'))
+    if os.getenv('TTS_DELIVERY', 'server').lower() == 'browser' and browser_engines > 1:
+        # Each client is bound to one of several engine processes, so one client's render does not delay the others
+        return TextToSpeechPool(lambda: IsolatedTextToSpeech(audio_cache_dir=cache_dir if cache_enabled else None,
+                                                             audio_cache_bytes=cache_bytes), size=browser_engines)
+    if os.getenv('TTS_ISOLATED', 'false').lower() == 'true':
+        # Run the engine in a supervised child process so its driver loop never stalls the server
+        engine = IsolatedTextToSpeech(audio_cache_dir=cache_dir if cache_enabled else None, audio_cache_bytes=cache_bytes)
+        return engine
+    audio_cache = None
+    if cache_enabled:
+        # Render speech to files and replay repeated text from a size-bounded on-disk cache
+        audio_cache = AudioCache(directory=cache_dir, max_bytes=cache_bytes)
+    engine = TextToSpeech(audio_cache=audio_cache)
+    # Example: engine.set_voice_by_name("Aria")  # Uncomment and set to your preferred voice
+    return engine
+
+startup_started = time.time()
+startup = StartupOrchestrator()
+startup.register('camera', Camera, critical=True, timeout=float(os.getenv('CAMERA_INIT_TIMEOUT', '15')))
+startup.register('vision_api', lambda: VisionAPI(api_key=api_key, api_url=api_url, system_prompt=system_prompt),
+                 critical=True, timeout=10)
+startup.register('drawing_analyzer', DrawingAnalyzer, critical=True, timeout=10)
+startup.register('imagen', create_imagen_client, critical=True, timeout=10)
+startup.register('tts', create_tts, critical=False, timeout=float(os.getenv('TTS_INIT_TIMEOUT', '20')))
+startup.start()
+if not startup.wait_for_critical():
+    logger.error(f"Error initializing components: {startup.report()}")
+    raise RuntimeError("Critical components failed to initialize")
+
+camera = startup.get('camera')
+vision_api = startup.get('vision_api')
+drawing_analyzer = startup.get('drawing_analyzer')
+imagen_client = startup.get('imagen')
+logger.info(f"Critical components initialized in {time.time() - startup_started:.2f}s "
+            "(text-to-speech and image generation may still be warming up)")
+
+# Optionally compute the reference prompt speculatively right after each critique
+prompt_prefetcher = PromptPrefetcher(
+    vision_api,
+    enabled=os.getenv('SPECULATIVE_PREFETCH_ENABLED', 'false').lower() == 'true',
+    waste_budget_per_hour=int(os.getenv('SPECULATIVE_WASTE_BUDGET_PER_HOUR', '20'))
+)
+
+# Thumbnails for the history pages, made when a snapshot or reference image is saved
+thumbnails = ThumbnailCache(os.path.join(drawing_analyzer.history_dir, 'thumbnails'))
+
+def on_reference_generated(snapshot_path, reference_path, prompt):
+    """Link a generated reference and its prompt to the snapshot's history entry and pre-generate its thumbnail."""
+    drawing_analyzer.link_reference(snapshot_path, reference_path, prompt)
+    thumbnails.ensure(reference_path)
+
+# Running aggregates of critique insights (techniques, suggestions, detected elements)
+insight_analytics = InsightAnalytics(os.path.join(drawing_analyzer.history_dir, 'insights.json.gz'))
+
+# Reference images are generated by background jobs; progress is pushed over Socket.IO.
+# Each job gets a total time budget for the description -> refine -> Imagen pipeline.
+reference_jobs = ReferenceJobManager(
+    vision_api,
+    imagen_client,
+    emit=socketio.emit,
+    max_workers=int(os.getenv('REFERENCE_JOB_WORKERS', '2')),
+    max_queued=int(os.getenv('REFERENCE_JOB_MAX_QUEUED', '8')),
+    deadline_seconds=float(os.getenv('REFERENCE_DEADLINE_SECONDS', '90')),
+    prefetcher=prompt_prefetcher,
+    on_success=on_reference_generated
+)
+
+# Critiques run in the background; a newer request from the same client supersedes an older one
+critique_runner = LatestWinsExecutor(
+    max_workers=int(os.getenv('CRITIQUE_WORKERS', '4')),
+    deadline_seconds=float(os.getenv('CRITIQUE_DEADLINE_SECONDS', '60'))
+)
+
+# Client activity, used by the idle watchdog when running as a resident server
+connected_clients = 0
+last_activity = time.time()
+activity_lock = Lock()
+
+# Where speech is played: 'server' (this machine's speakers) or 'browser' (audio is sent to the requesting client)
+tts_delivery = os.getenv('TTS_DELIVERY', 'server').lower()
+audio_delivery = None
+if tts_delivery == 'browser':
+    audio_delivery = AudioDelivery(
+        directory=os.getenv('TTS_AUDIO_DIR', 'tts_audio'),
+        compress=os.getenv('TTS_AUDIO_COMPRESS', 'true').lower() == 'true'
     )
-    tts = TextToSpeech()
-    # Example: tts.set_voice_by_name("Aria")  # Uncomment and set to your preferred voice
-    drawing_analyzer = DrawingAnalyzer()
-    imagen_client = VertexImagen() # Initialize Vertex Imagen client
-    logger.info("All components initialized successfully")
-except Exception as e:
-    logger.error(f"Error initializing components: {e}")
-    raise
 
 last_snapped_image = None
 last_critique = None  # Store the last critique text
-session_history = []
-
-def strip_markdown(text):
-    # Remove markdown formatting for TTS clarity
-    text = re.sub(r'[`*_>#\-]', '', text)
-    text = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', text)  # [text](url) -> text
-    text = re.sub(r'!\[.*?\]\(.*?\)', '', text)      # ![alt](url) -> (remove)
-    return text.strip()
-
-def get_session_prompt():
-    """Return a verbose prompt for the first call, then context-aware for subsequent calls."""
-    if not session_history:
-        return os.getenv('VISION_SYSTEM_PROMPT',
-            "You are an expert comic book art assistant. Analyze the user's drawing and provide helpful, constructive, and actionable feedback to improve their comic art technique. Focus on clarity, anatomy, perspective, and storytelling. Be concise and supportive."
-        )
-    else:
-        last = session_history[-1]
-        return (
-            "Continue providing brief, actionable feedback for the user's comic drawing based on previous suggestions. "
-            "Only mention new or ongoing improvements.\n"
-            f"Previous suggestion: {last}"
-        )
+last_critique_image = None  # Snapshot last_critique is about (last_snapped_image may be a skipped frame)
+session_context = SessionContext()  # Earlier critiques, sent as conversation turns within a token budget
+session_id = uuid.uuid4().hex[:12]  # Changes when the user restarts the session
+state_lock = Lock()  # Guards the globals above, which critique workers update
+
+def read_thumbnail(name):
+    """JPEG bytes of a cached thumbnail, or None."""
+    if not name:
+        return None
+    try:
+        with open(os.path.join(thumbnails.directory, name), 'rb') as f:
+            return f.read()
+    except OSError as e:
+        logger.warning(f"Could not read thumbnail {name}: {e}")
+        return None
+
+def get_tts():
+    """The text-to-speech engine, or None while it is still initializing (or failed to)."""
+    return startup.get('tts')
+
+def speak_for_client(tts, text, client_id, request_id):
+    """Speak text on the server, or in browser delivery mode render it and send it to the client."""
+    if audio_delivery is None:
+        tts.speak(text)
+        return
+
+    def deliver(path, temporary, index, final):
+        # Runs on the TTS engine thread: compression is handed off so rendering continues
+        audio_delivery.publish_async(path, temporary, lambda filename: socketio.emit('tts_audio', {
+            'url': f"/tts_audio/{filename}",
+            'index': index,
+            'final': final,
+            'request_id': request_id
+        }, to=client_id), key=client_id)
+
+    tts.speak(text, key=client_id, deliver=deliver)
 
 @app.route('/')
 def index():
@@ -111,13 +220,18 @@ def last_snapped_image_route():
 
 @app.route('/restart_session', methods=['POST'])
 def restart_session():
-    global session_history
-    session_history = []
+    global session_id
+    session_context.reset()
+    with state_lock:
+        session_id = uuid.uuid4().hex[:12]
     logger.info("Session restarted by user.")
     return jsonify({"status": "success", "message": "Session restarted. The AI will start over and forget previous suggestions."})
 
 @app.route('/set_tts_speed', methods=['POST'])
 def set_tts_speed():
+    tts = get_tts()
+    if tts is None:
+        return jsonify({"status": "error", "message": "Text-to-speech is not ready"}), 503
     data = request.get_json()
     rate = int(data.get('rate', 150))
     tts.set_rate(rate)
@@ -126,6 +240,9 @@ def set_tts_speed():
 
 @app.route('/set_tts_enabled', methods=['POST'])
 def set_tts_enabled():
+    tts = get_tts()
+    if tts is None:
+        return jsonify({"status": "error", "message": "Text-to-speech is not ready"}), 503
     data = request.get_json()
     enabled = bool(data.get('enabled', True))
     tts.enabled = enabled
@@ -134,11 +251,17 @@ def set_tts_enabled():
 
 @app.route('/get_tts_voices', methods=['GET'])
 def get_tts_voices():
+    tts = get_tts()
+    if tts is None:
+        return jsonify([]), 503
     voices = tts.get_available_voices()
     return jsonify(voices)
 
 @app.route('/set_tts_voice', methods=['POST'])
 def set_tts_voice():
+    tts = get_tts()
+    if tts is None:
+        return jsonify({"status": "error", "message": "Text-to-speech is not ready"}), 503
     data = request.get_json()
     voice_id = data.get('voice_id')
     if voice_id:
@@ -153,7 +276,13 @@ def set_tts_voice():
 
 @app.route('/request_assistance', methods=['POST'])
 def request_assistance():
-    global last_snapped_image, session_history, last_critique
+    """
+    Capture a frame and start a critique in the background.
+
+    Returns immediately; the critique is delivered over Socket.IO. A newer request
+    from the same client supersedes an older one still in flight, so only the
+    freshest critique is shown and spoken.
+    """
     try:
         # Capture current frame
         success, frame = camera.get_frame()
@@ -161,113 +290,132 @@ def request_assistance():
         if not success:
             logger.warning("Failed to capture frame for /request_assistance")
             return jsonify({"error": "Failed to capture frame"}), 500
-        
-        # Save frame for reference
+
+        # Save frame for reference (milliseconds, so quick repeat clicks do not overwrite each other)
         timestamp = int(time.time())
-        frame_path = f"captured_images/request_{timestamp}.jpg"
+        frame_path = f"captured_images/request_{int(time.time() * 1000)}.jpg"
         cv2.imwrite(frame_path, frame)
-        last_snapped_image = frame_path
         logger.debug(f"Frame saved to {frame_path}")
 
-        # Get critique
-        current_system_prompt = get_session_prompt()
-        logger.info(f"Using session prompt for critique: {current_system_prompt[:80]}...")
-        response = vision_api.analyze_drawing(frame)
+        data = request.get_json(silent=True) or {}
+        client_id = data.get('client_id')
+        user_id = data.get('user_id')
+        force_full = bool(data.get('full', False))
+        ticket, superseded = critique_runner.submit(
+            client_id or 'default',
+            lambda ticket: run_critique(ticket, frame, frame_path, timestamp, force_full, client_id, user_id)
+        )
+        tts = get_tts()
+        if superseded and tts is not None:
+            # The older critique will be discarded; do not let its speech keep playing
+            tts.stop_speech(reason='superseded', key=client_id if audio_delivery is not None else None)
+
+        return jsonify({"status": "accepted", "timestamp": timestamp, "request_id": ticket.id}), 202
+
+    except Exception as e:
+        logger.error(f"Error processing assistance request: {e}", exc_info=True)
+        return jsonify({"error": str(e)}), 500
+
+def run_critique(ticket, frame, frame_path, timestamp, force_full, client_id, user_id=None):
+    """Background part of /request_assistance; drops its result if a newer request arrived."""
+    global last_snapped_image, last_critique, last_critique_image
+    try:
+        # Get critique (the fast tier may skip the full critique if nothing changed)
+        response = vision_api.analyze_drawing(frame, force_full=force_full, deadline=ticket.deadline,
+                                              context=session_context)
+    except Exception as e:
+        if ticket.is_current():
+            socketio.emit('assistance_error', {'error': str(e), 'request_id': ticket.id}, to=client_id)
+        raise
+
+    critique_text = response.get('text', '')
+    logger.debug(f"Vision API critique response: {critique_text[:100]}...")
+
+    # Process response for display/TTS
+    analysis = drawing_analyzer.process_response({"text": critique_text}, save=False)
+
+    # Only the freshest critique counts: nothing is recorded for a superseded one
+    if not ticket.is_current():
+        logger.info(f"Discarding superseded critique {ticket.id}")
+        return
 
-        critique_text = response.get('text', '')
+    new_critique = False
+    with state_lock:
+        last_snapped_image = frame_path
         if "Error" in critique_text or "failed" in critique_text.lower():
             logger.error(f"Failed to get critique: {critique_text}")
+        elif response.get('skipped'):
+            logger.info("No material change since the last critique, keeping previous critique.")
         else:
             last_critique = critique_text
-            session_history.append(critique_text)
-            session_history = session_history[-5:]
-
-        logger.debug(f"Vision API critique response: {critique_text[:100]}...")
+            last_critique_image = frame_path
+            new_critique = True
 
-        # Process response for display/TTS
-        analysis = drawing_analyzer.process_response({"text": critique_text})
+    # Only real critiques are recorded, not skip notices or errors
+    if new_critique:
+        drawing_analyzer.save_analysis(analysis, snapshot_path=frame_path)
+        thumbnail = thumbnails.ensure(frame_path, frame)
+        session_context.add(critique_text, read_thumbnail(thumbnail) if session_context.include_images else None)
+        insight_analytics.record(analysis.get('insights', {}), session_id=session_id, user_id=user_id,
+                                 timestamp=timestamp)
 
-        socketio.emit('assistance_response', {
-            'text': analysis['text'],
-            'timestamp': timestamp
-        })
+    socketio.emit('assistance_response', {
+        'text': analysis['text'],
+        'timestamp': timestamp,
+        'request_id': ticket.id
+    }, to=client_id)
 
-        if tts.enabled and analysis.get('speak', True):
-            tts_text = strip_markdown(analysis['text'])
-            tts.speak(tts_text)
+    tts = get_tts()
+    if tts is not None and tts.enabled and analysis.get('speak', True):
+        speak_for_client(tts, analysis['speech_text'], client_id, ticket.id)
 
-        logger.info("Assistance response sent and TTS triggered if enabled.")
-        return jsonify({"status": "success", "timestamp": timestamp}), 200
+    logger.info("Assistance response sent and TTS triggered if enabled.")
 
-    except Exception as e:
-        logger.error(f"Error processing assistance request: {e}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+    if new_critique:
+        prompt_prefetcher.schedule(frame_path, frame, critique_text)
 
 @app.route('/generate_reference', methods=['POST'])
 def generate_reference():
-    global last_snapped_image, last_critique, vision_api, imagen_client
     logger.info("Received request to generate reference image.")
 
-    if not last_snapped_image or not os.path.exists(last_snapped_image):
-        logger.warning("No snapped image found to base reference on.")
-        return jsonify({"error": "No image has been snapped yet. Please request assistance first."}), 400
+    imagen_status = imagen_client.status()
+    if imagen_status['state'] in ('disabled', 'failed'):
+        logger.warning(f"Image generation unavailable: {imagen_status['error']}")
+        return jsonify({"error": f"Image generation is unavailable: {imagen_status['error']}"}), 503
+
+    # The reference is rendered from the snapshot the critique was written about, which is also
+    # the one saved in history, so the generated image can be linked to its entry
+    with state_lock:
+        critique, critique_image = last_critique, last_critique_image
 
-    if not last_critique:
+    if not critique_image or not os.path.exists(critique_image):
+        logger.warning("No critiqued image found to base reference on.")
+        return jsonify({"error": "No image has been critiqued yet. Please request assistance first."}), 400
+
+    if not critique:
         logger.warning("No critique available for the last snapped image.")
         return jsonify({"error": "No critique available. Please request assistance first."}), 400
 
     try:
-        # Step 1: Get Detailed Description
-        logger.info(f"Getting description for image: {last_snapped_image}")
-        with open(last_snapped_image, "rb") as f:
-            img_bytes = f.read()
-        frame = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
-        if frame is None:
-            logger.error("Failed to decode last snapped image for description.")
-            return jsonify({"error": "Failed to process snapped image."}), 500
-
-        desc_response = vision_api.get_image_description(frame)
-        description_text = desc_response.get('text', '')
-        if not description_text or "Error" in description_text:
-            logger.error(f"Failed to get image description: {description_text}")
-            return jsonify({"error": f"Failed to get image description: {description_text}"}), 500
-        logger.info(f"Image Description: {description_text[:100]}...")
-
-        # Step 2: Get Last Critique
-        logger.info(f"Using Last Critique: {last_critique[:100]}...")
-
-        # Step 3: Refine Generation Prompt
-        logger.info("Refining generation prompt...")
-        prompt_response = vision_api.refine_generation_prompt(description_text, last_critique)
-        final_image_prompt = prompt_response.get('text', '')
-        if not final_image_prompt or "Error" in final_image_prompt:
-            logger.error(f"Failed to refine generation prompt: {final_image_prompt}")
-            return jsonify({"error": f"Failed to refine generation prompt: {final_image_prompt}"}), 500
-        logger.info(f"Final Image Generation Prompt: {final_image_prompt}")
-
-        # Step 4: Generate Image from Text
-        logger.info("Calling imagen_client.generate_image_from_text...")
-        generated_image_path = imagen_client.generate_image_from_text(
-            prompt=final_image_prompt,
-            output_dir="generated_images",
-            filename_prefix="reference"
-        )
-        logger.info(f"imagen_client.generate_image_from_text returned: {generated_image_path}")
-
-        # Step 5: Return Result
-        if generated_image_path:
-            logger.info(f"Reference image generated successfully: {generated_image_path}")
-            relative_path = os.path.relpath(generated_image_path, start=os.getcwd())
-            web_path = relative_path.replace('\\', '/')
-            socketio.emit('reference_image_ready', {'image_path': f"/{web_path}"})
-            return jsonify({"status": "success", "message": "Reference image generated.", "image_path": f"/{web_path}"})
-        else:
-            logger.error("Failed to generate reference image (generate_image_from_text returned None).")
-            return jsonify({"error": "Failed to generate reference image using AI."}), 500
-
-    except Exception as e:
-        logger.error(f"Error in /generate_reference route handler: {e}", exc_info=True)
-        return jsonify({"error": f"Server error during reference generation: {e}"}), 500
+        job = reference_jobs.submit(critique_image, critique)
+    except QueueFullError as e:
+        logger.warning(f"Reference job rejected: {e}")
+        return jsonify({"error": f"Too many reference images are being generated, please try again shortly ({e})."}), 429
+    return jsonify({"status": "success", "message": "Reference generation queued.", "job_id": job['id']}), 202
+
+@app.route('/generate_reference/<job_id>', methods=['GET'])
+def reference_job_status(job_id):
+    """Report the state and per-stage timing of a reference generation job."""
+    job = reference_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id"}), 404
+    return jsonify(job)
+
+@app.route('/generate_reference/<job_id>/cancel', methods=['POST'])
+def cancel_reference_job(job_id):
+    if not reference_jobs.cancel(job_id):
+        return jsonify({"error": "Job not found or already finished"}), 404
+    return jsonify({"status": "success", "job_id": job_id})
 
 @app.route('/generated_images/<path:filename>')
 def serve_generated_image(filename):
@@ -275,6 +423,150 @@ def serve_generated_image(filename):
     logger.debug(f"Serving generated image: {filename}")
     return send_from_directory('generated_images', filename)
 
+@app.route('/captured_images/<path:filename>')
+def serve_captured_image(filename):
+    """Serve snapshots from the captured_images directory."""
+    return send_from_directory('captured_images', filename)
+
+def web_path(path):
+    return f"/{path.replace(os.sep, '/')}" if path else None
+
+def history_item(entry, full=False):
+    """Public view of a history entry with links to its snapshot, reference and thumbnails."""
+    item = {
+        'id': entry['id'],
+        'timestamp': entry['recorded_at'],
+        'text': entry['text'] if full else entry['text'][:300],
+        'insights': entry.get('insights'),
+        'snapshot_url': web_path(entry['snapshot_path']),
+        'reference_url': web_path(entry['reference_path']),
+        'snapshot_thumbnail_url': None,
+        'reference_thumbnail_url': None,
+    }
+    if full:
+        item['reference_prompt'] = entry.get('reference_prompt')
+    # Thumbnails are normally made when the image is saved; older entries get theirs on first listing
+    for kind in ('snapshot', 'reference'):
+        name = thumbnails.ensure(entry[f'{kind}_path']) if entry[f'{kind}_path'] else None
+        if name:
+            item[f'{kind}_thumbnail_url'] = f"/history/thumbnails/{name}"
+    return item
+
+@app.route('/history', methods=['GET'])
+def history():
+    """Page through past critiques, newest first. Pass the returned next_cursor to get the following page."""
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 100)
+        entries, next_cursor = drawing_analyzer.get_history_page(limit, request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "items": [history_item(entry) for entry in entries],
+        "next_cursor": next_cursor
+    })
+
+@app.route('/history/search', methods=['GET'])
+def search_history():
+    """Ranked full-text search over past critiques and reference prompts, e.g. ?q=foreshortening"""
+    if drawing_analyzer.history is None:
+        return jsonify({"error": "Search is unavailable: drawing history is disabled (SAVE_DRAWING_HISTORY=false)"}), 503
+    if not drawing_analyzer.history.search_enabled:
+        return jsonify({"error": "Search is unavailable: this SQLite build has no FTS5 full-text index"}), 503
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query 'q'"}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    started = time.time()
+    results = drawing_analyzer.search_history(query, limit)
+    query_ms = round((time.time() - started) * 1000, 2)  # The search alone, not building the items below
+    items = []
+    for entry in results:
+        item = history_item(entry)
+        item['snippet'] = entry['snippet']
+        item['rank'] = entry['rank']
+        items.append(item)
+    return jsonify({"items": items, "query_ms": query_ms})
+
+@app.route('/insights', methods=['GET'])
+def insights():
+    """
+    Most frequent insights, e.g. ?category=suggestions&window=week&n=10
+
+    scope is 'global' (default), 'session' (the current session) or 'user:<id>';
+    without a category the top items of every category are returned.
+    """
+    window = request.args.get('window', 'week')
+    scope = request.args.get('scope', 'global')
+    if scope == 'session':
+        scope = f"session:{session_id}"
+    n = min(max(request.args.get('n', 10, type=int), 1), 100)
+    category = request.args.get('category')
+    try:
+        if not category:
+            return jsonify(insight_analytics.summary(scope, window, n))
+        top = insight_analytics.top(category, window, scope, n)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"scope": scope, "window": window, "category": category,
+                    "top": [{"text": text, "count": count} for text, count in top]})
+
+@app.route('/history/<int:entry_id>', methods=['GET'])
+def history_entry(entry_id):
+    entry = drawing_analyzer.get_history_entry(entry_id)
+    if entry is None:
+        return jsonify({"error": "Unknown history entry"}), 404
+    return jsonify(history_item(entry, full=True))
+
+@app.route('/history/thumbnails/<filename>')
+def serve_history_thumbnail(filename):
+    """Serve a cached thumbnail; thumbnails never change, so browsers may cache them for good."""
+    return send_from_directory(thumbnails.directory, filename, max_age=31536000)
+
+@app.route('/tts_audio/<path:filename>')
+def serve_tts_audio(filename):
+    """Serve speech rendered for browser delivery; supports HTTP range requests."""
+    if audio_delivery is None:
+        return jsonify({"error": "Browser audio delivery is disabled"}), 404
+    return send_from_directory(audio_delivery.directory, filename, conditional=True, max_age=3600)
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness check: the process is up and serving requests."""
+    return jsonify({"status": "ok", "app": "drawr", "pid": os.getpid()})
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness check: 200 once every critical component is ready, 503 before that."""
+    ready = startup.is_ready()
+    components = {name: info['state'] for name, info in startup.report().items()}
+    return jsonify({"ready": ready, "components": components}), 200 if ready else 503
+
+@app.route('/startup', methods=['GET'])
+def startup_report():
+    """Readiness report: state and initialization time of every component."""
+    return jsonify({
+        "ready": startup.is_ready(),
+        "components": startup.report(),
+        "imagen_model": imagen_client.status()
+    })
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    """Report latency and request statistics for the AI backends."""
+    return jsonify({
+        "vision": vision_api.get_stats(),
+        "reference_jobs": reference_jobs.stats(),
+        "critiques": critique_runner.stats(),
+        "prefetch": prompt_prefetcher.stats(),
+        "imagen": imagen_client.status(),
+        "tts": get_tts().get_stats() if get_tts() is not None else None,
+        "tts_delivery": audio_delivery.stats() if audio_delivery is not None else None,
+        "thumbnails": thumbnails.stats(),
+        "insights": insight_analytics.summary(n=3),
+        "session_context": session_context.stats(),
+        "startup": startup.report()
+    })
+
 def gen_frames():
     """Generate camera frames"""
     while True:
@@ -291,12 +583,91 @@ def gen_frames():
 
 @socketio.on('connect')
 def handle_connect():
+    global connected_clients
+    with activity_lock:
+        connected_clients += 1
     logger.info("Client connected")
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    global connected_clients, last_activity
+    with activity_lock:
+        connected_clients = max(0, connected_clients - 1)
+        last_activity = time.time()
+    tts = get_tts()
+    if tts is not None and audio_delivery is not None:
+        tts.forget(request.sid)  # Browser deliveries are keyed by socket id
     logger.info("Client disconnected")
 
+@app.before_request
+def record_activity():
+    global last_activity
+    last_activity = time.time()
+
+components_shut_down = False
+
+def shutdown_components():
+    """Release the camera, stop speech and write pending history and insights before the process exits."""
+    global components_shut_down
+    if components_shut_down:
+        return
+    components_shut_down = True
+    logger.info("Shutting down components...")
+    try:
+        camera.release()
+    except Exception as e:
+        logger.error(f"Error releasing camera: {e}")
+    tts = get_tts()
+    if tts is not None:
+        tts.close()
+    if audio_delivery is not None:
+        audio_delivery.close()
+    drawing_analyzer.close()
+    insight_analytics.save()
+
+def idle_watchdog(idle_timeout):
+    """Exit once no browser has been connected for idle_timeout seconds (resident mode)."""
+    while True:
+        time.sleep(min(30, idle_timeout))
+        with activity_lock:
+            idle_for = time.time() - last_activity
+            idle = connected_clients == 0 and idle_for >= idle_timeout
+        if idle:
+            logger.info(f"No clients for {idle_for:.0f}s, shutting down resident server.")
+            shutdown_components()
+            os._exit(0)
+
+# Printed on stdout once the server accepts connections; launcher.py waits for this line
+READY_SENTINEL = "DRAWR_SERVER_READY"
+
+def announce_when_listening(port, timeout=30, on_ready=None):
+    """Print READY_SENTINEL (and call on_ready, if given) as soon as the server socket accepts connections."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                print(f"{READY_SENTINEL} http://localhost:{port}", flush=True)
+                if on_ready is not None:
+                    on_ready()
+                return
+        except OSError:
+            time.sleep(0.01)
+    logger.error(f"Server did not start listening on port {port} within {timeout}s")
+
 if __name__ == '__main__':
     logger.info("Starting AI Drawing Assistant")
-    socketio.run(app, debug=False, host='0.0.0.0', port=5000)
+    port = int(os.getenv('PORT', '5000'))
+    Thread(target=announce_when_listening, args=(port,), daemon=True).start()
+    # Set by launcher.py in resident mode: keep running between window sessions, exit when idle
+    idle_timeout = float(os.getenv('DRAWR_IDLE_TIMEOUT', '0'))
+    if idle_timeout > 0:
+        logger.info(f"Resident mode: exiting after {idle_timeout:.0f}s without clients")
+        Thread(target=idle_watchdog, args=(idle_timeout,), daemon=True).start()
+    # Ctrl-C and normal exits run the atexit hook; SIGTERM (and CTRL_BREAK on Windows, which the
+    # launcher sends to stop the server) is turned into a normal exit so it runs too
+    atexit.register(shutdown_components)
+    for name in ('SIGTERM', 'SIGBREAK'):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), lambda signum, frame: sys.exit(0))
+    # A detached resident server has no terminal, which Flask-SocketIO otherwise refuses
+    socketio.run(app, debug=False, host='0.0.0.0', port=port, allow_unsafe_werkzeug=True)
@@ -0,0 +1,119 @@
+"""
+Micro-benchmark of critique text processing, as used when re-processing history in bulk.
+
+Usage:
+    python bench_text_pipeline.py [--history-dir drawing_history] [--count 20000] [--repeat 3]
+
+Critiques are read from the history store if it has any, otherwise synthetic
+ones are generated. Each is processed by the previous per-pattern
+implementation (clean, six insight regexes, suggestion regex, three markdown
+passes) and by DrawingAnalyzer.process_response, the path the app uses (with
+history saving disabled, so only text processing is timed), and the best
+throughput of each is reported.
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+from modules.history_store import HistoryStore
+from modules.drawing_analyzer import DrawingAnalyzer
+
+SAMPLE_SENTENCES = [
+    "Looking at your drawing, the proportions of the face are mostly consistent.",
+    "I see circles used as construction for the head and the shoulders.",
+    "There is good line weight variation along the jaw.",
+    "**Try** the cross hatching technique to deepen the shadow under the chin.",
+    "You might consider the technique of blind contour to loosen up your lines.",
+    "The ears sit a little too high; check them against the line of the eyes.",
+    "You've drawn the hair as a single mass, which reads well from a distance.",
+    "- Suggest softening the edges where the cheek turns away from the light.",
+    "See [this guide](https://example.com/foreshortening) on foreshortening.",
+    "Overall, a confident sketch with a clear light source from the left.",
+]
+
+
+def legacy_process(text):
+    """The per-pattern processing TextPipeline replaced, kept here as the baseline."""
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r'^(I can see that|Looking at your drawing|Based on the image|From what I can observe)', '', text)
+    text = text.strip()
+    insights = {'techniques': [], 'suggestions': [], 'detected_elements': []}
+    for pattern in [r'using (\w+\s\w+) technique', r'(\w+\s\w+) technique', r'technique of (\w+\s\w+)']:
+        insights['techniques'].extend(re.findall(pattern, text, re.IGNORECASE))
+    if 'suggest' in text.lower() or 'try' in text.lower() or 'consider' in text.lower():
+        insights['suggestions'] = re.findall(r'(?:suggest|try|consider)[^.!?]*[.!?]', text, re.IGNORECASE)
+    for pattern in [r'I (see|notice) (\w+)', r'there is (\w+\s\w+)', r'you\'ve drawn (\w+\s\w+)']:
+        matches = re.findall(pattern, text, re.IGNORECASE)
+        insights['detected_elements'].extend(m[-1] if isinstance(m, tuple) else m for m in matches)
+    for key in insights:
+        insights[key] = list(set(insights[key]))
+    speech = re.sub(r'[`*_>#\-]', '', text)
+    speech = re.sub(r'\[(.*?)\]\(.*?\)', r'\1', speech)
+    speech = re.sub(r'!\[.*?\]\(.*?\)', '', speech)
+    return {'text': text, 'speech_text': speech.strip(), 'insights': insights}
+
+
+def load_texts(history_dir, count):
+    path = os.path.join(history_dir, 'history.db')
+    if os.path.exists(path):
+        store = HistoryStore(path)
+        texts = [entry.get('text', '') for entry in store.recent(count)]
+        store.close()
+        if texts:
+            return texts, f"{len(texts)} critiques from {path}"
+    rng = random.Random(42)
+    texts = []
+    for _ in range(count):
+        paragraphs = [' '.join(rng.sample(SAMPLE_SENTENCES, rng.randint(2, 5))) for _ in range(rng.randint(1, 4))]
+        texts.append('\n\n\n'.join(paragraphs))
+    return texts, f"{count} synthetic critiques"
+
+
+def measure(process, texts, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text in texts:
+            process(text)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark critique text processing.")
+    parser.add_argument('--history-dir', default='drawing_history', help="Directory with history.db")
+    parser.add_argument('--count', type=int, default=20000, help="Number of critiques to process")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs per implementation; the best is reported")
+    args = parser.parse_args()
+
+    texts, description = load_texts(args.history_dir, args.count)
+    megabytes = sum(len(t.encode('utf-8')) for t in texts) / (1024 * 1024)
+    print(f"Processing {description} ({megabytes:.1f} MB), best of {args.repeat} runs")
+
+    os.environ['SAVE_DRAWING_HISTORY'] = 'false'
+    analyzer = DrawingAnalyzer()
+    results = {}
+    for name, process in [('legacy', legacy_process),
+                          ('analyzer', lambda text: analyzer.process_response({'text': text}))]:
+        elapsed = measure(process, texts, args.repeat)
+        results[name] = elapsed
+        print(f"  {name:<9} {elapsed * 1000:8.1f} ms  {len(texts) / elapsed:10.0f} critiques/s  "
+              f"{megabytes / elapsed:6.1f} MB/s")
+    print(f"  speedup   {results['legacy'] / results['analyzer']:.2f}x")
+
+    # Insights should agree; differences come from cue words inside other words (e.g. "country")
+    differing = sum(
+        1 for text in texts
+        if {k: set(v) for k, v in legacy_process(text)['insights'].items()}
+        != {k: set(v) for k, v in analyzer.process_response({'text': text})['insights'].items()}
+    )
+    print(f"  {differing} of {len(texts)} critiques have different insights")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
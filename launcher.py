@@ -7,14 +7,35 @@ import signal
 import threading
 import requests # Import requests library
 
+try:
+    import psutil # Optional, used to report memory use
+except ImportError:
+    psutil = None
+
 flask_process = None
 app_url = "http://localhost:5000" # Make sure this matches the host/port in app.py
+health_url = f"{app_url}/healthz"
+READY_SENTINEL = "DRAWR_SERVER_READY" # Printed by app.py on stdout once it accepts connections
+server_ready_event = threading.Event()
+
+# Resident mode: reuse a server that is already running, and leave it running after
+# the window closes; the server exits by itself after DRAWR_IDLE_TIMEOUT idle seconds.
+resident_mode = '--resident' in sys.argv or os.getenv('DRAWR_RESIDENT', 'false').lower() == 'true'
+idle_timeout = int(os.getenv('DRAWR_IDLE_TIMEOUT', '900'))
+
+# Embedded mode: run the Socket.IO server on a thread of this process instead of a child process
+embedded_mode = not resident_mode and (
+    '--embedded' in sys.argv or os.getenv('DRAWR_EMBEDDED', 'false').lower() == 'true')
+embedded_app = None # The imported app module in embedded mode
 
 # Function to continuously read and print output from a stream
 def stream_reader(stream, stream_name):
     try:
         for line in iter(stream.readline, b''):
-            print(f"[{stream_name}] {line.decode().strip()}")
+            text = line.decode(errors='replace').strip()
+            if text.startswith(READY_SENTINEL):
+                server_ready_event.set()
+            print(f"[{stream_name}] {text}")
         stream.close()
     except Exception as e:
         print(f"Error reading {stream_name}: {e}")
@@ -33,6 +54,26 @@ def start_flask_server():
     if sys.platform == "win32":
         kwargs['creationflags'] = subprocess.CREATE_NEW_PROCESS_GROUP
 
+    if resident_mode:
+        # Detach the server so it outlives this launcher; its output goes to a log file
+        log_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+        os.makedirs(log_dir, exist_ok=True)
+        log_file = open(os.path.join(log_dir, 'server_output.log'), 'ab')
+        if sys.platform == "win32":
+            kwargs['creationflags'] |= subprocess.DETACHED_PROCESS
+        else:
+            kwargs['start_new_session'] = True
+        flask_process = subprocess.Popen(
+            [python_executable, app_script],
+            stdin=subprocess.DEVNULL,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            env=dict(os.environ, DRAWR_IDLE_TIMEOUT=str(idle_timeout)),
+            **kwargs
+        )
+        print(f"Resident Flask server started with PID: {flask_process.pid} (output in {log_file.name})")
+        return
+
     flask_process = subprocess.Popen(
         [python_executable, app_script],
         stdout=subprocess.PIPE,
@@ -49,6 +90,52 @@ def start_flask_server():
     stdout_thread.start()
     stderr_thread.start()
 
+def start_embedded_server():
+    """Imports the app and runs its Socket.IO server on a daemon thread of this process."""
+    global embedded_app
+    # app.py uses paths relative to the project directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    print("Starting Flask server in-process")
+    import app as drawr_app # Initializes the components; logs go straight to this process's handlers
+    embedded_app = drawr_app
+    port = int(os.getenv('PORT', '5000'))
+    threading.Thread(target=drawr_app.announce_when_listening, args=(port,),
+                     kwargs={'on_ready': server_ready_event.set}, daemon=True).start()
+    threading.Thread(
+        target=drawr_app.socketio.run,
+        args=(drawr_app.app,),
+        kwargs={'host': '0.0.0.0', 'port': port, 'debug': False, 'use_reloader': False,
+                'allow_unsafe_werkzeug': True},
+        name="embedded-server",
+        daemon=True
+    ).start()
+
+def stop_embedded_server():
+    """Shutdown hook for embedded mode: releases the app's components before the launcher exits."""
+    if embedded_app is None:
+        return
+    print("Stopping in-process Flask server...")
+    try:
+        embedded_app.shutdown_components()
+    except Exception as e:
+        print(f"Error shutting down components: {e}")
+    # The server thread is a daemon and ends with the launcher process
+
+def report_footprint(time_to_window):
+    """Prints time-to-window and memory use so embedded and subprocess modes can be compared."""
+    mode = 'embedded' if embedded_mode else ('resident' if resident_mode else 'subprocess')
+    rss_mb = None
+    if psutil is not None:
+        processes = [psutil.Process()]
+        if flask_process and flask_process.poll() is None:
+            try:
+                processes.append(psutil.Process(flask_process.pid))
+            except psutil.Error:
+                pass
+        rss_mb = round(sum(p.memory_info().rss for p in processes) / (1024 * 1024), 1)
+    memory = f"{rss_mb} MB RSS across {len(processes)} process(es)" if rss_mb is not None else "memory n/a (install psutil)"
+    print(f"[Launcher] mode={mode} time_to_window={time_to_window:.2f}s {memory}")
+
 def stop_flask_server():
     """Stops the Flask server process."""
     global flask_process
@@ -78,8 +165,16 @@ def stop_flask_server():
     else:
         print("Flask server process already stopped or not started.")
 
+def find_running_server(timeout=0.5):
+    """Returns True if a DrawR server is already answering on app_url."""
+    try:
+        response = requests.get(health_url, timeout=timeout)
+        return response.status_code == 200 and response.json().get('app') == 'drawr'
+    except Exception:
+        return False
+
 def check_server_ready(url, timeout=1):
-    """Checks if the server at the URL is responding."""
+    """Checks if the server's health endpoint at the URL is responding."""
     try:
         response = requests.get(url, timeout=timeout)
         # Check for a successful status code (e.g., 200 OK)
@@ -100,16 +195,16 @@ def check_server_ready(url, timeout=1):
         print(f"Error checking server readiness at {url}: {e}")
         return False
 
-if __name__ == '__main__':
-    # Start Flask server in a separate thread
-    server_thread = threading.Thread(target=start_flask_server, daemon=True)
-    server_thread.start()
-
-    # Give the server a moment to start up - Replace sleep with active check
+def wait_for_server():
+    """Waits until the server is ready or exits the launcher if it fails to start."""
+    # Wait for the server's readiness handshake (READY_SENTINEL on its stdout).
+    # /healthz is polled as a fallback in case the line is missed; a resident server
+    # writes to a log file instead of our pipe, so it is polled frequently.
     print("Waiting for Flask server to start...")
     max_wait_time = 30 # Maximum seconds to wait for the server
-    wait_interval = 1 # Seconds between checks
+    fallback_poll_interval = 0.1 if resident_mode else 2 # Seconds between fallback health checks
     start_time = time.time()
+    last_poll = start_time
     server_ready = False
 
     while time.time() - start_time < max_wait_time:
@@ -118,11 +213,17 @@ if __name__ == '__main__':
             stop_flask_server()
             sys.exit(1)
 
-        if check_server_ready(app_url):
+        if server_ready_event.wait(timeout=0.05):
             server_ready = True
             break
-        print(f"Server not ready yet, waiting {wait_interval}s...")
-        time.sleep(wait_interval)
+        if time.time() - last_poll >= fallback_poll_interval:
+            last_poll = time.time()
+            if check_server_ready(health_url):
+                server_ready = True
+                break
+
+    if server_ready:
+        print(f"[Launcher] Server ready after {time.time() - start_time:.2f}s")
 
     if not server_ready:
         print(f"[Launcher] Flask server did not become ready within {max_wait_time} seconds. Exiting.")
@@ -135,15 +236,42 @@ if __name__ == '__main__':
         stop_flask_server() # Clean up just in case
         sys.exit(1) # Exit launcher
 
+if __name__ == '__main__':
+    launch_started = time.time()
+    if resident_mode and find_running_server():
+        print("[Launcher] Reusing the DrawR server that is already running.")
+    elif embedded_mode:
+        try:
+            start_embedded_server()
+        except Exception as e:
+            print(f"[Launcher] Error starting the in-process server: {e}")
+            sys.exit(1)
+        wait_for_server()
+    else:
+        # Start Flask server in a separate thread
+        server_thread = threading.Thread(target=start_flask_server, daemon=True)
+        server_thread.start()
+        wait_for_server()
+
     # Create and start the webview window
-    print(f"Creating webview window for {app_url}")
+    print(f"Creating webview window for {app_url} ({time.time() - launch_started:.2f}s after launch)")
     try:
-        webview.create_window('AI Drawing Assistant', app_url, width=1024, height=768)
-        # Pass the stop_flask_server function to be called when the window is closed
-        webview.start(stop_flask_server, debug=True) # Enable pywebview debug logging
+        window = webview.create_window('AI Drawing Assistant', app_url, width=1024, height=768)
+        window.events.shown += lambda: report_footprint(time.time() - launch_started)
+        # webview.start blocks until the window is closed (a function passed to it would run at start-up)
+        webview.start(debug=True) # Enable pywebview debug logging
+        if resident_mode:
+            print(f"[Launcher] Leaving the server running; it exits after {idle_timeout}s without clients.")
+        elif embedded_mode:
+            stop_embedded_server()
+        else:
+            stop_flask_server()
     except Exception as e:
         print(f"[Launcher] Error creating or starting webview: {e}")
-        stop_flask_server() # Ensure Flask server is stopped if webview fails
+        if embedded_mode:
+            stop_embedded_server()
+        elif not resident_mode:
+            stop_flask_server() # Ensure Flask server is stopped if webview fails
         sys.exit(1)
 
     print("Webview window closed. Exiting launcher.")
@@ -0,0 +1,66 @@
+"""
+Import legacy drawing_history/analysis_<timestamp>.json files into the history store.
+
+Usage:
+    python migrate_history.py [--history-dir drawing_history] [--keep]
+
+Each file is recorded with its file name as the source, so running the
+migration again does not create duplicates. Imported files are moved to
+<history-dir>/migrated/ unless --keep is given.
+"""
+import os
+import sys
+import json
+import shutil
+import argparse
+
+from modules.history_store import HistoryStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate per-file drawing history into the SQLite history store.")
+    parser.add_argument('--history-dir', default='drawing_history', help="Directory with analysis_*.json files")
+    parser.add_argument('--keep', action='store_true', help="Leave the JSON files in place after importing them")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.history_dir):
+        print(f"No history directory at {args.history_dir}, nothing to migrate.")
+        return 0
+
+    files = sorted(f for f in os.listdir(args.history_dir) if f.startswith('analysis_') and f.endswith('.json'))
+    store = HistoryStore(os.path.join(args.history_dir, 'history.db'), batch_size=500)
+    before = store.count()
+    imported, failed = [], 0
+    for filename in files:
+        path = os.path.join(args.history_dir, filename)
+        try:
+            with open(path, 'r') as f:
+                analysis = json.load(f)
+            timestamp = analysis.get('timestamp') or os.path.getmtime(path)
+            store.append(analysis, timestamp=float(timestamp), source=filename)
+            imported.append(filename)
+        except (OSError, ValueError) as e:
+            print(f"Skipping {filename}: {e}")
+            failed += 1
+    recorded = store.recorded_sources(imported)
+    added = store.count() - before
+    committed = store.close()
+    missing = [filename for filename in imported if filename not in recorded]
+
+    print(f"Read {len(imported)} files ({failed} unreadable), added {added} new entries to {store.path}.")
+    if not committed or missing:
+        # Never hide a source file whose entry may not have been written
+        print(f"Writing to the history store failed ({store.counters['failed']} entries, {len(missing)} files "
+              f"not recorded); leaving all files in place. Fix the problem and run the migration again.")
+        return 1
+
+    if not args.keep and imported:
+        migrated_dir = os.path.join(args.history_dir, 'migrated')
+        os.makedirs(migrated_dir, exist_ok=True)
+        for filename in imported:
+            shutil.move(os.path.join(args.history_dir, filename), os.path.join(migrated_dir, filename))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
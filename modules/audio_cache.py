@@ -0,0 +1,148 @@
+import os
+import json
+import hashlib
+import shutil
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class AudioCache:
+    """
+    Size-bounded on-disk LRU cache of synthesized speech.
+
+    Entries are audio files named by a hash of everything that affects the
+    synthesized sound (text, voice, rate and volume). Least recently used
+    entries are evicted once the total size exceeds `max_bytes`. How long each
+    entry took to synthesize is kept in a small index file, so a hit can be
+    credited with the synthesis time it saved.
+    """
+
+    INDEX_FILE = 'index.json'
+
+    def __init__(self, directory='tts_cache', max_bytes=100 * 1024 * 1024, extension='.wav'):
+        """
+        Initialize the cache
+
+        Args:
+            directory (str): Directory holding the cached audio files
+            max_bytes (int): Total size above which the least recently used entries are evicted
+            extension (str): File extension of the cached audio
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.extension = extension
+        self.entries = OrderedDict()  # key -> {'size', 'synth_seconds'}, least recently used first
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'synthesis_seconds_saved': 0.0}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    @staticmethod
+    def key(text, voice_id, rate, volume):
+        """Cache key for one utterance with the given voice settings."""
+        material = json.dumps([text, voice_id, rate, round(float(volume), 3)])
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.extension)
+
+    def get(self, key):
+        """
+        Look up an entry and mark it as recently used
+
+        Returns:
+            str | None: Path of the cached audio file, or None on a miss
+        """
+        with self._lock:
+            entry = self.entries.get(key)
+            path = self.path(key)
+            if entry is None or not os.path.exists(path):
+                if entry is not None:
+                    del self.entries[key]
+                self.counters['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.counters['hits'] += 1
+            self.counters['synthesis_seconds_saved'] += entry['synth_seconds']
+        try:
+            os.utime(path)  # Keeps the LRU order across restarts
+        except OSError:
+            pass
+        return path
+
+    def put(self, key, source_path, synth_seconds):
+        """
+        Move a freshly synthesized file into the cache
+
+        Args:
+            key (str): Cache key from `key()`
+            source_path (str): Synthesized audio file; it is moved, not copied
+            synth_seconds (float): Time the synthesis took
+
+        Returns:
+            str: Path of the cached file
+        """
+        path = self.path(key)
+        shutil.move(source_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self.entries[key] = {'size': size, 'synth_seconds': round(synth_seconds, 3)}
+            self.entries.move_to_end(key)
+            self._evict()
+            self._save_index()
+        return path
+
+    def stats(self):
+        """Entry count, size, hit rate and synthesis time saved."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = sum(entry['size'] for entry in self.entries.values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        stats['synthesis_seconds_saved'] = round(stats['synthesis_seconds_saved'], 3)
+        stats['max_bytes'] = self.max_bytes
+        return stats
+
+    def _evict(self):
+        # Caller holds self._lock
+        total = sum(entry['size'] for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key, entry = self.entries.popitem(last=False)
+            total -= entry['size']
+            self.counters['evictions'] += 1
+            try:
+                os.remove(self.path(key))
+            except OSError as e:
+                logger.warning(f"Could not remove evicted audio {key}: {e}")
+
+    def _load(self):
+        synth_seconds = {}
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        if os.path.exists(index_path):
+            try:
+                with open(index_path, 'r', encoding='utf-8') as f:
+                    synth_seconds = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable audio cache index: {e}")
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.extension):
+                full_path = os.path.join(self.directory, name)
+                files.append((os.path.getmtime(full_path), name[:-len(self.extension)], os.path.getsize(full_path)))
+        for _, key, size in sorted(files):
+            self.entries[key] = {'size': size, 'synth_seconds': synth_seconds.get(key, 0.0)}
+        with self._lock:
+            self._evict()
+        logger.info(f"Audio cache loaded {len(self.entries)} entries from {self.directory}")
+
+    def _save_index(self):
+        # Caller holds self._lock
+        index_path = os.path.join(self.directory, self.INDEX_FILE)
+        tmp_path = index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({key: entry['synth_seconds'] for key, entry in self.entries.items()}, f)
+        os.replace(tmp_path, index_path)
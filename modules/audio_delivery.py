@@ -0,0 +1,144 @@
+import os
+import time
+import uuid
+import shutil
+import subprocess
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class AudioDelivery:
+    """
+    Publishes rendered speech as files the browser can fetch.
+
+    Each chunk is compressed with ffmpeg when it is available (Opus in an Ogg
+    container, falling back to the original WAV) and stored under a random
+    name in `directory`, which the app serves with HTTP range support. Files
+    older than `keep_seconds` are removed as new ones are published.
+    publish_async() does this on a small pool of worker threads, so the TTS
+    engine thread goes on rendering while ffmpeg runs.
+    """
+
+    def __init__(self, directory='tts_audio', compress=True, bitrate='32k', keep_seconds=600, workers=2):
+        """
+        Initialize the publisher
+
+        Args:
+            directory (str): Directory the published audio files are served from
+            compress (bool): Whether to compress with ffmpeg if it is installed
+            bitrate (str): Opus bitrate passed to ffmpeg
+            keep_seconds (float): Age after which published files are deleted
+            workers (int): Threads publishing chunks for publish_async
+        """
+        self.directory = directory
+        self.bitrate = bitrate
+        self.keep_seconds = keep_seconds
+        self.ffmpeg = shutil.which('ffmpeg') if compress else None
+        self.counters = {'published': 0, 'compressed': 0, 'bytes_in': 0, 'bytes_out': 0, 'removed': 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="audio-delivery")
+        self._tails = {}  # key -> future of the last chunk queued for that key
+        os.makedirs(directory, exist_ok=True)
+        if compress and not self.ffmpeg:
+            logger.warning("ffmpeg not found; browser speech is delivered as uncompressed WAV")
+
+    def publish(self, path, temporary=False):
+        """
+        Store a rendered chunk for download
+
+        Args:
+            path (str): Rendered WAV file
+            temporary (bool): Whether `path` may be removed once published
+
+        Returns:
+            str: File name of the published audio inside `directory`
+        """
+        self._cleanup()
+        name = uuid.uuid4().hex
+        bytes_in = os.path.getsize(path)
+        published = None
+        if self.ffmpeg:
+            published = self._compress(path, os.path.join(self.directory, name + '.ogg'))
+        if published is None:
+            published = os.path.join(self.directory, name + '.wav')
+            shutil.copyfile(path, published)
+        if temporary:
+            os.remove(path)
+        with self._lock:
+            self.counters['published'] += 1
+            self.counters['compressed'] += published.endswith('.ogg')
+            self.counters['bytes_in'] += bytes_in
+            self.counters['bytes_out'] += os.path.getsize(published)
+        return os.path.basename(published)
+
+    def publish_async(self, path, temporary, callback, key=None):
+        """
+        Publish a chunk on a worker thread and call callback(filename) when it is stored
+
+        Chunks with the same key are published and reported in the order they were
+        queued, so a listener receives its chunks in sequence; different keys do
+        not wait for each other.
+
+        Args:
+            path (str): Rendered WAV file
+            temporary (bool): Whether `path` may be removed once published
+            callback (callable): Called with the published file name
+            key (str, optional): Listener the chunk belongs to
+        """
+        with self._lock:
+            previous = self._tails.get(key)
+            future = self._executor.submit(self._publish_after, previous, path, temporary, callback)
+            self._tails[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+
+    def _publish_after(self, previous, path, temporary, callback):
+        # The previous chunk was submitted earlier, so it is running or done, never queued behind this one
+        if previous is not None:
+            previous.exception()  # Waits without raising; failures were already logged
+        try:
+            callback(self.publish(path, temporary))
+        except Exception as e:
+            logger.error(f"Error publishing speech chunk: {e}")
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._tails.get(key) is future:
+                del self._tails[key]
+
+    def close(self):
+        """Wait for queued chunks to be published and stop the worker threads."""
+        self._executor.shutdown(wait=True)
+
+    def _compress(self, source, target):
+        command = [self.ffmpeg, '-y', '-loglevel', 'error', '-i', source, '-c:a', 'libopus', '-b:a', self.bitrate, target]
+        try:
+            subprocess.run(command, check=True, timeout=30, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+            return target
+        except (subprocess.SubprocessError, OSError) as e:
+            logger.warning(f"Audio compression failed, sending WAV instead: {e}")
+            if os.path.exists(target):
+                os.remove(target)
+            return None
+
+    def _cleanup(self):
+        cutoff = time.time() - self.keep_seconds
+        for name in os.listdir(self.directory):
+            full_path = os.path.join(self.directory, name)
+            try:
+                if os.path.getmtime(full_path) < cutoff:
+                    os.remove(full_path)
+                    with self._lock:
+                        self.counters['removed'] += 1
+            except OSError:
+                pass
+
+    def stats(self):
+        """Published chunk counts and the compression ratio achieved."""
+        with self._lock:
+            stats = dict(self.counters)
+        stats['compression_ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 3) if stats['bytes_in'] else None
+        stats['ffmpeg'] = bool(self.ffmpeg)
+        return stats
@@ -0,0 +1,81 @@
+import sys
+import time
+import wave
+import shutil
+import subprocess
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class AudioPlayer:
+    """
+    Plays audio files through the platform's player, stoppable between polls.
+
+    Windows uses winsound; macOS uses afplay; elsewhere the first of paplay,
+    aplay or ffplay found on the PATH is used.
+    """
+
+    CANDIDATES = [
+        ['paplay'],
+        ['aplay', '-q'],
+        ['ffplay', '-nodisp', '-autoexit', '-loglevel', 'quiet'],
+    ]
+
+    def __init__(self, poll_interval=0.05):
+        self.poll_interval = poll_interval
+        self.command = None
+        if sys.platform == 'win32':
+            self.available = True
+        elif sys.platform == 'darwin':
+            self.command = ['afplay']
+            self.available = True
+        else:
+            self.command = next((c for c in self.CANDIDATES if shutil.which(c[0])), None)
+            self.available = self.command is not None
+        if not self.available:
+            logger.warning("No audio player found; rendered speech cannot be played locally")
+
+    def play(self, path, should_stop=None):
+        """
+        Play an audio file and block until it finishes or `should_stop()` returns True
+
+        Returns:
+            bool: True if the file played to the end
+        """
+        should_stop = should_stop or (lambda: False)
+        if sys.platform == 'win32':
+            return self._play_winsound(path, should_stop)
+        process = subprocess.Popen(self.command + [path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while process.poll() is None:
+            if should_stop():
+                process.terminate()
+                process.wait()
+                return False
+            time.sleep(self.poll_interval)
+        return process.returncode == 0
+
+    def _play_winsound(self, path, should_stop):
+        import winsound
+        duration = self.duration(path)
+        if duration is None:
+            # Unknown length: play synchronously, which cannot be interrupted
+            winsound.PlaySound(path, winsound.SND_FILENAME)
+            return True
+        winsound.PlaySound(path, winsound.SND_FILENAME | winsound.SND_ASYNC)
+        end = time.time() + duration
+        while time.time() < end:
+            if should_stop():
+                winsound.PlaySound(None, 0)
+                return False
+            time.sleep(self.poll_interval)
+        return True
+
+    @staticmethod
+    def duration(path):
+        """Length of a WAV file in seconds, or None if it cannot be read."""
+        try:
+            with wave.open(path, 'rb') as f:
+                return f.getnframes() / float(f.getframerate())
+        except (OSError, wave.Error, EOFError, ZeroDivisionError):
+            return None
@@ -17,4 +17,9 @@ class Camera:
         ret, frame = self.cap.read()
         if not ret:
             logger.error("Failed to read frame from camera.")
-        return ret, frame
\ No newline at end of file
+        return ret, frame
+
+    def release(self):
+        """Release the capture device."""
+        if self.cap is not None:
+            self.cap.release()
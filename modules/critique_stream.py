@@ -0,0 +1,110 @@
+import time
+import logging
+
+from modules.text_pipeline import TextPipeline, SENTENCE_END
+
+logger = logging.getLogger(__name__)
+
+
+class CritiqueStream:
+    """
+    Incremental analysis of a critique that arrives in chunks.
+
+    Text is processed up to the last sentence boundary seen so far. Each
+    complete sentence is processed once: its speech text and insights are
+    derived from it alone, so the cost of a chunk does not grow with the
+    text received before it. finish() handles the unfinished tail, then
+    builds the display and speech text of the whole critique in one pass.
+    """
+
+    def __init__(self, pipeline=None, on_finish=None):
+        """
+        Start an empty stream
+
+        Args:
+            pipeline (TextPipeline, optional): Pipeline to process text with
+            on_finish (callable, optional): Called as on_finish(result, snapshot_path) by finish()
+        """
+        self.pipeline = pipeline or TextPipeline()
+        self.on_finish = on_finish
+        self.sentences = []
+        self.insights = {category: {} for category in TextPipeline.CATEGORIES}
+        self.result = None
+        self._chunks = []
+        self._pending = ''  # Text after the last sentence boundary
+        self._started = False
+
+    def feed(self, chunk):
+        """
+        Add a chunk of critique text
+
+        Args:
+            chunk (str): Next piece of the critique
+
+        Returns:
+            dict: 'sentences' completed by this chunk and 'insights' first seen in them (category -> items)
+
+        Raises:
+            RuntimeError: If the stream was already finished
+        """
+        if self.result is not None:
+            raise RuntimeError("Cannot feed a finished critique stream")
+        self._chunks.append(chunk)
+        searched = len(self._pending)
+        self._pending += chunk
+        # Only the new text (and the character before it) is searched. A boundary at the
+        # very end may still grow ("..." or a blank line), so it waits for more text.
+        boundary = None
+        for match in SENTENCE_END.finditer(self._pending, max(0, searched - 1)):
+            if match.end() < len(self._pending):
+                boundary = match
+        if boundary is None:
+            return self._update([], {})
+        complete, self._pending = self._pending[:boundary.start()], self._pending[boundary.end():]
+        return self._process(complete)
+
+    def finish(self, snapshot_path=None):
+        """
+        Process the remaining text and build the complete analysis, available as `result`
+
+        Args:
+            snapshot_path (str, optional): Snapshot the critique is about, passed to on_finish
+
+        Returns:
+            dict: 'sentences' and 'insights' completed by the remaining text, like feed()
+        """
+        if self.result is not None:
+            return self._update([], {})
+        update = self._process(self._pending) if self._pending.strip() else self._update([], {})
+        self._pending = ''
+        # The display and speech text are built once, from the whole critique
+        text = self.pipeline.clean(''.join(self._chunks))
+        self.result = {
+            'text': text,
+            'speech_text': self.pipeline.speech_text(text),
+            'sentences': self.sentences,
+            'insights': {category: list(items) for category, items in self.insights.items()},
+            'timestamp': int(time.time()),
+            'speak': True,  # Default to speaking the response
+        }
+        if self.on_finish is not None:
+            self.on_finish(self.result, snapshot_path)
+        return update
+
+    def _process(self, text):
+        if not self._started:
+            # The preamble check only applies to the start of the critique
+            text = self.pipeline.clean(text)
+            self._started = bool(text)
+        sentences = self.pipeline.sentences(self.pipeline.speech_text(text))
+        self.sentences.extend(sentences)
+        new_insights = {}
+        for category, items in self.pipeline.insights(text).items():
+            seen = self.insights[category]
+            new_insights[category] = [item for item in items if item not in seen]
+            seen.update(dict.fromkeys(new_insights[category]))
+        return self._update(sentences, new_insights)
+
+    def _update(self, sentences, insights):
+        return {'sentences': sentences,
+                'insights': {category: insights.get(category, []) for category in self.insights}}
@@ -0,0 +1,115 @@
+import time
+import threading
+import logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a pipeline stage cannot start or finish within the request deadline."""
+
+    def __init__(self, message, stage=None):
+        super().__init__(message)
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Time budget shared by every stage of a multi-step request.
+
+    Created once at the route entry and passed down to the API clients, which
+    use `timeout()` instead of their own fixed timeouts. `stage()` records how
+    long each step took and refuses to start a step once the budget is spent.
+    """
+
+    def __init__(self, budget, planned_stages=None):
+        """
+        Initialize the deadline
+
+        Args:
+            budget (float): Total time budget in seconds
+            planned_stages (list, optional): Stage names, so unrun stages can be reported as skipped
+        """
+        self.budget = budget
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + budget
+        self.planned_stages = list(planned_stages or [])
+        self.stages = []
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left in the budget, never negative."""
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self):
+        return time.monotonic() - self.started_at
+
+    def expired(self):
+        return time.monotonic() >= self.expires_at
+
+    def cancel(self):
+        """Spend the rest of the budget immediately, so no further stage or call starts."""
+        self.cancelled = True
+        self.expires_at = time.monotonic()
+
+    def timeout(self, cap=None):
+        """Timeout to use for a blocking call: the remaining budget, capped at `cap` seconds."""
+        remaining = self.remaining()
+        return min(cap, remaining) if cap is not None else remaining
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time one stage of the pipeline.
+
+        Raises:
+            DeadlineExceeded: If the budget is spent before the stage starts, or
+                it ran out while the stage was running
+        """
+        if self.expired():
+            self._record(name, 0.0, 'skipped')
+            raise DeadlineExceeded(self._message('before', name), stage=name)
+
+        start = time.monotonic()
+        try:
+            yield
+        except Exception:
+            self._record(name, time.monotonic() - start, 'timeout' if self.expired() else 'error')
+            raise
+        seconds = time.monotonic() - start
+        if self.expired():
+            self._record(name, seconds, 'timeout')
+            raise DeadlineExceeded(self._message('during', name), stage=name)
+        self._record(name, seconds, 'ok')
+
+    def skip(self, name, status='skipped'):
+        """Record a stage that did not need to run, e.g. because its result was precomputed."""
+        self._record(name, 0.0, status)
+
+    def _message(self, when, name):
+        if self.cancelled:
+            return f"Cancelled {when} stage '{name}'"
+        return f"Deadline of {self.budget:g}s exceeded {when} stage '{name}'"
+
+    def _record(self, name, seconds, status):
+        if self.cancelled and status in ('skipped', 'timeout'):
+            status = 'cancelled'
+        logger.info(f"Stage '{name}' {status} after {seconds:.2f}s ({self.remaining():.1f}s of budget left)")
+        with self._lock:
+            self.stages.append({'name': name, 'seconds': round(seconds, 3), 'status': status})
+
+    def report(self):
+        """Per-stage time accounting, including planned stages that never ran."""
+        with self._lock:
+            stages = list(self.stages)
+        seen = {stage['name'] for stage in stages}
+        stages += [{'name': name, 'seconds': 0.0, 'status': 'skipped'}
+                   for name in self.planned_stages if name not in seen]
+        return {
+            'budget': self.budget,
+            'elapsed': round(self.elapsed(), 3),
+            'remaining': round(self.remaining(), 3),
+            'stages': stages,
+        }
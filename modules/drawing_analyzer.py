@@ -1,8 +1,10 @@
 import logging
-import json
 import time
 import os
-import re
+
+from modules.history_store import HistoryStore
+from modules.text_pipeline import TextPipeline
+from modules.critique_stream import CritiqueStream
 
 logger = logging.getLogger(__name__)
 
@@ -11,169 +13,144 @@ class DrawingAnalyzer:
     
     def __init__(self):
         """Initialize the drawing analyzer"""
-        self.drawing_history = []
         self.save_history = os.getenv('SAVE_DRAWING_HISTORY', 'true').lower() == 'true'
         self.history_dir = 'drawing_history'
-        
-        # Create history directory if needed
-        if self.save_history and not os.path.exists(self.history_dir):
-            os.makedirs(self.history_dir)
+        self.history = None
+        self.pipeline = TextPipeline()
+
+        # Analyses are kept in an indexed SQLite store inside the history directory
+        if self.save_history:
+            self.history = HistoryStore(os.path.join(self.history_dir, 'history.db'))
             
         logger.info("Drawing analyzer initialized")
     
-    def process_response(self, api_response):
+    def process_response(self, api_response, snapshot_path=None, save=True):
         """
         Process the raw API response into structured feedback
         
         Args:
             api_response (dict): Raw response from the vision API
+            snapshot_path (str, optional): Snapshot the response is about, linked in the history
+            save (bool): Whether to save the analysis to history (if history is enabled)
         
         Returns:
-            dict: Processed analysis with text and metadata
+            dict: Processed analysis with display text, speech text, sentences, insights and metadata
         """
-        # Extract the text content from the response
-        text = api_response.get('text', '')
-        
-        # Clean up text (remove excessive newlines, etc.)
-        text = self._clean_text(text)
-        
-        # Extract key insights if any
-        insights = self._extract_insights(text)
-        
-        # Build the result object
-        result = {
-            'text': text,
-            'timestamp': int(time.time()),
-            'insights': insights,
-            'speak': True  # Default to speaking the response
-        }
-        
-        # Condense text for speech if it's very long
-        if len(text) > 500:
-            result['speech_text'] = self._condense_for_speech(text)
-            result['speak'] = True
+        # The whole text is at hand, so it is processed in one pass rather than sentence by sentence
+        result = self.pipeline.process(api_response.get('text', ''))
+        result['timestamp'] = int(time.time())
+        result['speak'] = True  # Default to speaking the response
         
         # Save to history if enabled
-        if self.save_history:
-            self._save_to_history(result)
+        if save and self.save_history:
+            self._save_to_history(result, snapshot_path)
         
         return result
+
+    def stream(self):
+        """
+        Start analyzing a critique that arrives in chunks
+
+        Feed chunks with `feed(chunk)`, which returns the sentences and insights
+        they complete, then call `finish(snapshot_path)`. The complete analysis is
+        then in the stream's `result` (and saved to history if enabled), with the
+        same fields process_response returns.
+
+        Returns:
+            CritiqueStream: A new stream
+        """
+        return CritiqueStream(self.pipeline, on_finish=self._save_to_history if self.save_history else None)
     
-    def _clean_text(self, text):
-        """Clean up text for better presentation"""
-        # Replace multiple newlines with double newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
-        
-        # Ensure text doesn't start with common AI preambles
-        text = re.sub(r'^(I can see that|Looking at your drawing|Based on the image|From what I can observe)', '', text)
-        text = text.strip()
-        
-        return text
-    
-    def _extract_insights(self, text):
-        """Extract key insights from text using simple heuristics"""
-        insights = {
-            'techniques': [],
-            'suggestions': [],
-            'detected_elements': []
-        }
-        
-        # Look for techniques mentioned
-        technique_patterns = [
-            r'using (\w+\s\w+) technique',
-            r'(\w+\s\w+) technique',
-            r'technique of (\w+\s\w+)'
-        ]
-        
-        for pattern in technique_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            insights['techniques'].extend(matches)
-        
-        # Look for suggestions
-        if 'suggest' in text.lower() or 'try' in text.lower() or 'consider' in text.lower():
-            suggestion_sentences = re.findall(r'(?:suggest|try|consider)[^.!?]*[.!?]', text, re.IGNORECASE)
-            insights['suggestions'] = suggestion_sentences
-        
-        # Look for detected elements (very simple approach)
-        element_patterns = [
-            r'I (see|notice) (\w+)',
-            r'there is (\w+\s\w+)',
-            r'you\'ve drawn (\w+\s\w+)'
-        ]
-        
-        for pattern in element_patterns:
-            matches = re.findall(pattern, text, re.IGNORECASE)
-            # Flatten and extract just the element parts
-            elements = [m[-1] if isinstance(m, tuple) else m for m in matches]
-            insights['detected_elements'].extend(elements)
-        
-        # Remove duplicates
-        for key in insights:
-            insights[key] = list(set(insights[key]))
-        
-        return insights
-    
-    def _condense_for_speech(self, text):
-        """Create a shorter version suitable for speech"""
-        # Get first paragraph
-        first_para = text.split('\n\n')[0]
-        
-        # If still too long, get first few sentences
-        if len(first_para) > 300:
-            sentences = first_para.split('.')
-            condensed = '. '.join(sentences[:3]) + '.'
-            return condensed
-        
-        return first_para
-    
-    def _save_to_history(self, analysis):
-        """Save analysis to history file"""
+    def save_analysis(self, analysis, snapshot_path=None):
+        """Save an analysis from process_response(save=False) to history, if history is enabled"""
+        if self.save_history:
+            self._save_to_history(analysis, snapshot_path)
+
+    def _save_to_history(self, analysis, snapshot_path=None):
+        """Queue the analysis for the history store (written in batches)"""
         try:
-            timestamp = analysis['timestamp']
-            filename = f"{self.history_dir}/analysis_{timestamp}.json"
-            
-            with open(filename, 'w') as f:
-                json.dump(analysis, f, indent=2)
-            
-            # Keep track of history items
-            self.drawing_history.append({
-                'timestamp': timestamp,
-                'file': filename
-            })
-            
-            # Limit history size
-            if len(self.drawing_history) > 100:
-                self.drawing_history = self.drawing_history[-100:]
-                
+            # Speech text and sentences are cheap to derive again from the text, so they are not stored
+            stored = {k: v for k, v in analysis.items() if k not in ('speech_text', 'sentences')}
+            self.history.append(stored, snapshot_path=snapshot_path)
         except Exception as e:
             logger.error(f"Error saving analysis history: {e}")
     
     def get_history(self, limit=10):
-        """Get recent analysis history"""
+        """Get recent analysis history, newest first"""
+        if not self.save_history:
+            return []
         try:
-            history_items = []
-            
-            if not self.save_history:
-                return []
-                
-            # Get list of history files
-            files = os.listdir(self.history_dir)
-            analysis_files = [f for f in files if f.startswith('analysis_') and f.endswith('.json')]
-            
-            # Sort by timestamp (newest first)
-            analysis_files.sort(reverse=True)
-            
-            # Load the specified number of items
-            for filename in analysis_files[:limit]:
-                try:
-                    with open(os.path.join(self.history_dir, filename), 'r') as f:
-                        item = json.load(f)
-                        history_items.append(item)
-                except Exception as e:
-                    logger.error(f"Error loading history file {filename}: {e}")
-            
-            return history_items
-                
+            return self.history.recent(limit)
+        except Exception as e:
+            logger.error(f"Error retrieving history: {e}")
+            return []
+
+    def get_history_range(self, start, end, limit=100):
+        """
+        Get analyses recorded in a time range, oldest first
+
+        Args:
+            start (float): Range start as a Unix timestamp (inclusive)
+            end (float): Range end as a Unix timestamp (exclusive)
+            limit (int): Maximum number of entries
+        """
+        if not self.save_history:
+            return []
+        try:
+            return self.history.between(start, end, limit)
         except Exception as e:
             logger.error(f"Error retrieving history: {e}")
             return []
+
+    def get_history_page(self, limit=20, cursor=None):
+        """
+        Get one page of history, newest first
+
+        Args:
+            limit (int): Page size
+            cursor (str, optional): Cursor returned with the previous page
+
+        Returns:
+            tuple: (entries, next_cursor), next_cursor is None on the last page
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        if not self.save_history:
+            return [], None
+        return self.history.page(limit, cursor)
+
+    def get_history_entry(self, entry_id):
+        """Get one history entry by id, or None"""
+        if not self.save_history:
+            return None
+        return self.history.get(entry_id)
+
+    def link_reference(self, snapshot_path, reference_path, prompt=None):
+        """Record the reference image generated from a snapshot, and its prompt, on that snapshot's latest analysis"""
+        if not self.save_history:
+            return
+        try:
+            self.history.set_reference(snapshot_path, reference_path, prompt)
+        except Exception as e:
+            logger.error(f"Error linking reference image in history: {e}")
+
+    def search_history(self, query, limit=20):
+        """
+        Search past critiques and reference prompts, best matches first
+
+        Returns:
+            list: Matching entries with 'snippet' and 'rank'; empty if history or search is unavailable
+        """
+        if not self.save_history or not self.history.search_enabled:
+            return []
+        try:
+            return self.history.search(query, limit)
+        except Exception as e:
+            logger.error(f"Error searching history: {e}")
+            return []
+
+    def close(self):
+        """Write any queued history entries"""
+        if self.history is not None:
+            self.history.close()
@@ -0,0 +1,367 @@
+import os
+import re
+import json
+import time
+import atexit
+import base64
+import queue
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStore:
+    """
+    Append-only store of drawing analyses in SQLite (WAL mode).
+
+    Writes are queued and committed in batches by a single writer thread, so
+    callers never wait on the disk. Reads use one connection per thread and,
+    thanks to WAL, do not block the writer. Entries are indexed by timestamp,
+    so recent-N and time-range queries are index range scans rather than
+    directory listings. Pages are addressed with keyset cursors, so every
+    page costs the same no matter how deep into the history it is.
+
+    When SQLite has FTS5, critiques and refined reference prompts are also
+    kept in a full-text index that triggers update on every insert and
+    update, so it never needs a rebuild after the first one.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS analyses (
+               id INTEGER PRIMARY KEY AUTOINCREMENT,
+               timestamp REAL NOT NULL,
+               text TEXT NOT NULL,
+               insights TEXT,
+               data TEXT NOT NULL,
+               source TEXT
+           )""",
+        "CREATE INDEX IF NOT EXISTS idx_analyses_timestamp ON analyses (timestamp, id)",
+        # Set for entries imported from legacy files, so a migration can be re-run safely
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_analyses_source ON analyses (source)",
+    ]
+
+    # Applied in order to databases whose user_version is lower than the migration's position + 1
+    MIGRATIONS = [
+        [
+            "ALTER TABLE analyses ADD COLUMN snapshot_path TEXT",
+            "ALTER TABLE analyses ADD COLUMN reference_path TEXT",
+            "CREATE INDEX IF NOT EXISTS idx_analyses_snapshot ON analyses (snapshot_path)",
+        ],
+        [
+            "ALTER TABLE analyses ADD COLUMN reference_prompt TEXT",
+        ],
+    ]
+
+    # Full-text index over the analyses table (external content), kept current by triggers
+    SEARCH_SCHEMA = [
+        """CREATE VIRTUAL TABLE analyses_fts USING fts5(
+               text, reference_prompt, content='analyses', content_rowid='id', tokenize='porter unicode61')""",
+        """CREATE TRIGGER analyses_fts_insert AFTER INSERT ON analyses BEGIN
+               INSERT INTO analyses_fts (rowid, text, reference_prompt) VALUES (new.id, new.text, new.reference_prompt);
+           END""",
+        """CREATE TRIGGER analyses_fts_delete AFTER DELETE ON analyses BEGIN
+               INSERT INTO analyses_fts (analyses_fts, rowid, text, reference_prompt)
+               VALUES ('delete', old.id, old.text, old.reference_prompt);
+           END""",
+        """CREATE TRIGGER analyses_fts_update AFTER UPDATE OF text, reference_prompt ON analyses BEGIN
+               INSERT INTO analyses_fts (analyses_fts, rowid, text, reference_prompt)
+               VALUES ('delete', old.id, old.text, old.reference_prompt);
+               INSERT INTO analyses_fts (rowid, text, reference_prompt) VALUES (new.id, new.text, new.reference_prompt);
+           END""",
+        # Index whatever was stored before the search index existed
+        "INSERT INTO analyses_fts (analyses_fts) VALUES ('rebuild')",
+    ]
+
+    _FLUSH = object()  # Queue marker that makes the writer commit what it has collected
+
+    def __init__(self, path='drawing_history/history.db', batch_size=50, flush_interval=1.0):
+        """
+        Open (or create) the store
+
+        Args:
+            path (str): SQLite database file
+            batch_size (int): Queued entries that trigger an immediate commit
+            flush_interval (float): Max seconds an entry waits in the queue before it is committed
+        """
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.counters = {'appended': 0, 'committed': 0, 'batches': 0, 'failed': 0}
+        self._queue = queue.Queue()
+        self._local = threading.local()
+        self._flushed = threading.Condition()
+        self._closed = False
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in self.SCHEMA:
+                conn.execute(statement)
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            for number, statements in enumerate(self.MIGRATIONS[version:], start=version + 1):
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+            self.search_enabled = self._ensure_search_index(conn)
+        self._writer = threading.Thread(target=self._write_loop, name="history-writer", daemon=True)
+        self._writer.start()
+        # The writer is a daemon thread; make sure the last batch is committed when the interpreter exits
+        atexit.register(self.close)
+
+    def _ensure_search_index(self, conn):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'analyses_fts'").fetchone():
+            return True
+        try:
+            for statement in self.SEARCH_SCHEMA:
+                conn.execute(statement)
+        except sqlite3.OperationalError as e:
+            conn.rollback()
+            logger.warning(f"Full-text search unavailable (SQLite without FTS5?): {e}")
+            return False
+        logger.info("Built the full-text search index over the history")
+        return True
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; commits skip the per-transaction fsync
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def append(self, analysis, timestamp=None, source=None, snapshot_path=None):
+        """
+        Queue an analysis for writing
+
+        Args:
+            analysis (dict): Processed analysis with at least 'text'
+            timestamp (float, optional): Entry time, defaults to now
+            source (str, optional): Identifier of a migrated legacy file; duplicates are ignored
+            snapshot_path (str, optional): Path of the drawing snapshot the analysis is about
+        """
+        self._enqueue(
+            "INSERT OR IGNORE INTO analyses (timestamp, text, insights, data, source, snapshot_path) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                timestamp if timestamp is not None else time.time(),
+                analysis.get('text', ''),
+                json.dumps(analysis.get('insights')),
+                json.dumps(analysis),
+                source,
+                snapshot_path,
+            ))
+
+    def set_reference(self, snapshot_path, reference_path, prompt=None):
+        """Queue linking a generated reference image (and the prompt it was made from) to the newest analysis of a snapshot."""
+        self._enqueue(
+            "UPDATE analyses SET reference_path = ?, reference_prompt = ? WHERE id = ("
+            "SELECT id FROM analyses WHERE snapshot_path = ? ORDER BY timestamp DESC, id DESC LIMIT 1)",
+            (reference_path, prompt, snapshot_path))
+
+    def _enqueue(self, sql, params):
+        if self._closed:
+            raise RuntimeError("History store is closed")
+        with self._flushed:
+            self.counters['appended'] += 1
+        self._queue.put((sql, params))
+
+    def flush(self, timeout=5):
+        """Block until everything appended so far has been committed."""
+        target = self.counters['appended']
+        self._queue.put(self._FLUSH)  # Ends the writer's current batch early
+        with self._flushed:
+            return self._flushed.wait_for(lambda: self.counters['committed'] + self.counters['failed'] >= target,
+                                          timeout)
+
+    def close(self):
+        """
+        Commit pending entries and stop the writer thread
+
+        Returns:
+            bool: True if every appended entry was committed, False if a write failed or the writer did not finish
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._writer.join(10)
+        return not self._writer.is_alive() and self.counters['failed'] == 0 and not self._pending()
+
+    def _write_loop(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Collect a batch until it is full, flush_interval has passed, or a flush/close is requested
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                if item is self._FLUSH:
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        try:
+            with conn:
+                for sql, params in batch:
+                    conn.execute(sql, params)
+            outcome = 'committed'
+        except sqlite3.Error as e:
+            logger.error(f"Error writing {len(batch)} history entries: {e}")
+            outcome = 'failed'
+        with self._flushed:
+            self.counters[outcome] += len(batch)
+            self.counters['batches'] += 1
+            self._flushed.notify_all()
+
+    def _pending(self):
+        return self.counters['appended'] > self.counters['committed'] + self.counters['failed']
+
+    def _query(self, sql, params):
+        if self._pending():
+            self.flush()  # Read your own writes
+        rows = self._reader().execute(sql, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    @staticmethod
+    def _entry(row):
+        entry = json.loads(row['data'])
+        entry['id'] = row['id']
+        entry['recorded_at'] = row['timestamp']
+        entry['snapshot_path'] = row['snapshot_path']
+        entry['reference_path'] = row['reference_path']
+        entry['reference_prompt'] = row['reference_prompt']
+        return entry
+
+    @staticmethod
+    def encode_cursor(entry):
+        return base64.urlsafe_b64encode(f"{entry['recorded_at']!r}:{entry['id']}".encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        try:
+            timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+            return float(timestamp), int(entry_id)
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    def page(self, limit=20, cursor=None):
+        """
+        One page of analyses, newest first
+
+        Args:
+            limit (int): Page size
+            cursor (str, optional): `next_cursor` of the previous page
+
+        Returns:
+            tuple: (entries, next_cursor) where next_cursor is None on the last page
+        """
+        if cursor:
+            timestamp, entry_id = self.decode_cursor(cursor)
+            entries = self._query(
+                "SELECT * FROM analyses WHERE (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (timestamp, entry_id, limit + 1))
+        else:
+            entries = self._query("SELECT * FROM analyses ORDER BY timestamp DESC, id DESC LIMIT ?", (limit + 1,))
+        next_cursor = self.encode_cursor(entries[limit - 1]) if len(entries) > limit else None
+        return entries[:limit], next_cursor
+
+    @staticmethod
+    def _match_expression(query):
+        # Quote every term so user input is never parsed as FTS5 syntax; "quoted phrases" stay phrases
+        terms = re.findall(r'"([^"]+)"|(\w+)', query)
+        quoted = ['"{}"'.format((phrase or word).replace('"', '')) for phrase, word in terms]
+        return ' '.join(quoted)
+
+    def search(self, query, limit=20):
+        """
+        Full-text search over critiques and reference prompts, best matches first
+
+        Args:
+            query (str): Words or "quoted phrases"; all must match (word forms are stemmed)
+            limit (int): Maximum number of results
+
+        Returns:
+            list: Entries with an added 'snippet' (matches marked with [ ]) and 'rank' (lower is better)
+        """
+        if not self.search_enabled:
+            raise RuntimeError("Full-text search is not available")
+        expression = self._match_expression(query)
+        if not expression:
+            return []
+        if self._pending():
+            self.flush()
+        rows = self._reader().execute(
+            "SELECT analyses.*, bm25(analyses_fts, 1.0, 0.5) AS rank, "
+            "snippet(analyses_fts, -1, '[', ']', '...', 16) AS snippet "
+            "FROM analyses_fts JOIN analyses ON analyses.id = analyses_fts.rowid "
+            "WHERE analyses_fts MATCH ? ORDER BY rank LIMIT ?",
+            (expression, limit)).fetchall()
+        results = []
+        for row in rows:
+            entry = self._entry(row)
+            entry['snippet'] = row['snippet']
+            entry['rank'] = round(row['rank'], 4)
+            results.append(entry)
+        return results
+
+    def get(self, entry_id):
+        """A single analysis by id, or None."""
+        entries = self._query("SELECT * FROM analyses WHERE id = ?", (entry_id,))
+        return entries[0] if entries else None
+
+    def recent(self, limit=10):
+        """The newest `limit` analyses, newest first."""
+        return self._query("SELECT * FROM analyses ORDER BY timestamp DESC, id DESC LIMIT ?", (limit,))
+
+    def between(self, start, end, limit=100):
+        """Analyses with start <= timestamp < end, oldest first."""
+        return self._query(
+            "SELECT * FROM analyses WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp, id LIMIT ?",
+            (start, end, limit))
+
+    def recorded_sources(self, sources):
+        """The subset of `sources` (legacy file identifiers) that are recorded in the store."""
+        if self._pending():
+            self.flush()
+        sources = list(sources)
+        found = set()
+        for start in range(0, len(sources), 500):
+            chunk = sources[start:start + 500]
+            rows = self._reader().execute(
+                f"SELECT source FROM analyses WHERE source IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+            found.update(row[0] for row in rows)
+        return found
+
+    def count(self):
+        if self._pending():
+            self.flush()
+        return self._reader().execute("SELECT COUNT(*) FROM analyses").fetchone()[0]
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['queued'] = self._queue.qsize()
+        return stats
@@ -0,0 +1,239 @@
+import os
+import re
+import gzip
+import json
+import time
+import heapq
+import threading
+import logging
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class InsightAnalytics:
+    """
+    Running aggregates of the insights extracted from each critique.
+
+    Every insight is counted as it arrives, per scope (all critiques, one
+    session, one user) and per category (techniques, suggestions, detected
+    elements), in daily buckets. Alongside the buckets, a rolling counter per
+    window (day, week) is kept up to date by adding new insights and
+    subtracting buckets that fall out of the window, so "top suggestions this
+    week" is answered from memory without summing buckets or reading history.
+    The buckets are saved as gzipped JSON; the rolling counters are rebuilt
+    from them on load.
+    """
+
+    CATEGORIES = ['techniques', 'suggestions', 'detected_elements']
+    WINDOWS = {'day': 1, 'week': 7}  # Window name -> number of daily buckets
+
+    def __init__(self, path='drawing_history/insights.json.gz', bucket_seconds=86400, keep_buckets=30,
+                 max_sessions=200, save_interval=30, max_items=1000):
+        """
+        Initialize the aggregates, loading saved ones if present
+
+        Args:
+            path (str): File the aggregates are persisted to
+            bucket_seconds (int): Length of one time bucket
+            keep_buckets (int): Number of most recent buckets kept per scope
+            max_sessions (int): Number of most recently active sessions kept
+            save_interval (float): Min seconds between saves triggered by new insights
+            max_items (int): Distinct insights kept in the all-time totals; rarer ones are dropped
+        """
+        self.path = path
+        self.bucket_seconds = bucket_seconds
+        self.keep_buckets = max(keep_buckets, max(self.WINDOWS.values()))
+        self.max_sessions = max_sessions
+        self.save_interval = save_interval
+        self.max_items = max_items
+        self.scopes = OrderedDict()  # scope key -> {'totals', 'buckets', 'windows', 'expired', 'critiques'}
+        self._dirty = False
+        self._last_save = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def normalize(item):
+        """Canonical form of an insight so the same advice worded slightly differently is counted together."""
+        text = re.sub(r'[^\w\s]', '', str(item).lower())
+        return re.sub(r'\s+', ' ', text).strip()[:120]
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def _scope(self, key):
+        # Caller holds self._lock
+        scope = self.scopes.get(key)
+        if scope is None:
+            scope = self.scopes[key] = {
+                'totals': {c: Counter() for c in self.CATEGORIES},
+                'buckets': OrderedDict(),  # bucket number -> {category: Counter}
+                'windows': {w: {c: Counter() for c in self.CATEGORIES} for w in self.WINDOWS},
+                # Per window, the newest bucket already outside it (and subtracted from it)
+                'expired': {w: self._bucket(time.time()) - size for w, size in self.WINDOWS.items()},
+                'critiques': 0,
+            }
+        self.scopes.move_to_end(key)
+        sessions = [k for k in self.scopes if k.startswith('session:')]
+        for stale in sessions[:max(0, len(sessions) - self.max_sessions)]:
+            del self.scopes[stale]
+        return scope
+
+    def record(self, insights, session_id=None, user_id=None, timestamp=None):
+        """
+        Count the insights of one critique
+
+        Args:
+            insights (dict): Category -> list of items, as produced by DrawingAnalyzer
+            session_id (str, optional): Session the critique belongs to
+            user_id (str, optional): User the critique belongs to
+            timestamp (float, optional): Critique time, defaults to now
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        bucket = self._bucket(timestamp)
+        items = {c: Counter(filter(None, map(self.normalize, insights.get(c) or []))) for c in self.CATEGORIES}
+        keys = ['global']
+        if session_id:
+            keys.append(f"session:{session_id}")
+        if user_id:
+            keys.append(f"user:{user_id}")
+        current = self._bucket(time.time())
+        with self._lock:
+            for key in keys:
+                scope = self._scope(key)
+                self._advance(scope, current)
+                scope['critiques'] += 1
+                counts = scope['buckets'].setdefault(bucket, {c: Counter() for c in self.CATEGORIES})
+                if bucket < max(scope['buckets']):
+                    scope['buckets'] = OrderedDict(sorted(scope['buckets'].items()))  # Back-dated insight
+                windows = [w for name, w in scope['windows'].items() if bucket > scope['expired'][name]]
+                for category, counter in items.items():
+                    totals = scope['totals'][category]
+                    totals.update(counter)
+                    if len(totals) > 2 * self.max_items:
+                        scope['totals'][category] = Counter(dict(totals.most_common(self.max_items)))
+                    counts[category].update(counter)
+                    for window in windows:
+                        window[category].update(counter)
+            self._dirty = True
+            due = time.time() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def _advance(self, scope, current_bucket):
+        # Caller holds self._lock; subtract buckets that left each rolling window, drop buckets past keep_buckets
+        for name, size in self.WINDOWS.items():
+            low, mark = current_bucket - size, scope['expired'][name]
+            if low <= mark:
+                continue
+            window = scope['windows'][name]
+            for bucket, counts in scope['buckets'].items():
+                if mark < bucket <= low:
+                    for category, counter in counts.items():
+                        window[category].subtract(counter)
+                        window[category] += Counter()  # Drop zero counts
+            scope['expired'][name] = low
+        while scope['buckets'] and next(iter(scope['buckets'])) <= current_bucket - self.keep_buckets:
+            scope['buckets'].popitem(last=False)
+
+    def top(self, category, window='week', scope='global', n=10):
+        """
+        Most frequent insights of a category
+
+        Args:
+            category (str): One of CATEGORIES
+            window (str): 'day', 'week' or 'all'
+            scope (str): 'global', 'session:<id>' or 'user:<id>'
+            n (int): Number of results
+
+        Returns:
+            list: [(insight, count)] most frequent first
+
+        Raises:
+            ValueError: For an unknown category or window
+        """
+        if category not in self.CATEGORIES:
+            raise ValueError(f"Unknown category '{category}', expected one of {self.CATEGORIES}")
+        if window != 'all' and window not in self.WINDOWS:
+            raise ValueError(f"Unknown window '{window}', expected 'all' or one of {list(self.WINDOWS)}")
+        with self._lock:
+            data = self.scopes.get(scope)
+            if data is None:
+                return []
+            if window == 'all':
+                counter = data['totals'][category]
+            else:
+                self._advance(data, self._bucket(time.time()))
+                counter = data['windows'][window][category]
+            return heapq.nlargest(n, counter.items(), key=lambda item: item[1])
+
+    def summary(self, scope='global', window='week', n=5):
+        """Top insights of every category for one scope."""
+        with self._lock:
+            critiques = self.scopes[scope]['critiques'] if scope in self.scopes else 0
+        return {
+            'scope': scope,
+            'window': window,
+            'critiques': critiques,
+            'top': {category: self.top(category, window, scope, n) for category in self.CATEGORIES},
+        }
+
+    def save(self):
+        """Write the aggregates to disk if they changed since the last save."""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = {
+                'bucket_seconds': self.bucket_seconds,
+                'scopes': {
+                    key: {
+                        'critiques': scope['critiques'],
+                        'totals': {c: dict(counter) for c, counter in scope['totals'].items()},
+                        'buckets': {str(b): {c: dict(counter) for c, counter in counts.items()}
+                                    for b, counts in scope['buckets'].items()},
+                    }
+                    for key, scope in self.scopes.items()
+                },
+            }
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            tmp_path = self.path + '.tmp'
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+                json.dump(data, f, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"Error saving insight analytics: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable insight analytics file: {e}")
+            return
+        if data.get('bucket_seconds') != self.bucket_seconds:
+            logger.warning("Insight analytics were saved with a different bucket size; time windows start empty")
+        current = self._bucket(time.time())
+        with self._lock:
+            for key, saved in data.get('scopes', {}).items():
+                scope = self._scope(key)
+                scope['critiques'] = saved.get('critiques', 0)
+                for category in self.CATEGORIES:
+                    scope['totals'][category].update(saved.get('totals', {}).get(category, {}))
+                if data.get('bucket_seconds') != self.bucket_seconds:
+                    continue
+                for bucket, counts in sorted(saved.get('buckets', {}).items(), key=lambda item: int(item[0])):
+                    bucket = int(bucket)
+                    scope['buckets'][bucket] = {c: Counter(counts.get(c, {})) for c in self.CATEGORIES}
+                    # Rebuild the rolling windows from the buckets still inside them
+                    for name, size in self.WINDOWS.items():
+                        if bucket > current - size:
+                            for category in self.CATEGORIES:
+                                scope['windows'][name][category].update(counts.get(category, {}))
+                self._advance(scope, current)
+        logger.info(f"Loaded insight analytics for {len(self.scopes)} scopes")
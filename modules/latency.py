@@ -0,0 +1,78 @@
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """Rolling latency and error statistics, grouped by an arbitrary key (e.g. call type)."""
+
+    def __init__(self, window=200):
+        """
+        Initialize the tracker
+
+        Args:
+            window (int): Number of most recent samples kept per key
+        """
+        self.window = window
+        self._samples = {}
+        self._outcomes = {}
+        self._lock = threading.Lock()
+
+    def record(self, key, seconds, ok=True):
+        """Record one call duration and whether it succeeded."""
+        with self._lock:
+            if key not in self._samples:
+                self._samples[key] = deque(maxlen=self.window)
+                self._outcomes[key] = deque(maxlen=self.window)
+            if ok:
+                self._samples[key].append(seconds)
+            self._outcomes[key].append(bool(ok))
+
+    def percentile(self, key, pct, min_samples=1):
+        """
+        Get a latency percentile for a key
+
+        Args:
+            key (str): Key to look up
+            pct (float): Percentile between 0 and 100
+            min_samples (int): Minimum number of samples required
+
+        Returns:
+            float | None: Latency in seconds, or None if there are too few samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(key, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(pct / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def count(self, key):
+        """Number of recorded calls (successful or not) currently in the window."""
+        with self._lock:
+            return len(self._outcomes.get(key, ()))
+
+    def error_rate(self, key):
+        """Fraction of failed calls in the window, 0.0 if nothing was recorded."""
+        with self._lock:
+            outcomes = self._outcomes.get(key)
+            if not outcomes:
+                return 0.0
+            return outcomes.count(False) / len(outcomes)
+
+    def summary(self):
+        """Return a JSON-serializable summary of every key."""
+        with self._lock:
+            keys = list(self._outcomes.keys())
+        result = {}
+        for key in keys:
+            p50 = self.percentile(key, 50)
+            p90 = self.percentile(key, 90)
+            p99 = self.percentile(key, 99)
+            result[key] = {
+                'count': self.count(key),
+                'error_rate': round(self.error_rate(key), 3),
+                'p50': round(p50, 3) if p50 is not None else None,
+                'p90': round(p90, 3) if p90 is not None else None,
+                'p99': round(p99, 3) if p99 is not None else None,
+            }
+        return result
@@ -0,0 +1,84 @@
+import uuid
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+
+class Ticket:
+    """Handle for one submitted task; only the newest ticket per key is current."""
+
+    def __init__(self, runner, key, deadline_seconds):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.deadline = Deadline(deadline_seconds)
+        self._runner = runner
+
+    def is_current(self):
+        """True while no newer task has been submitted for the same key."""
+        return self._runner.current(self.key) is self
+
+
+class LatestWinsExecutor:
+    """
+    Runs background tasks where only the most recent task per key matters.
+
+    Submitting a task for a key supersedes the previous one: its ticket stops
+    being current and its Deadline is cancelled, so API calls that take the
+    deadline stop early. Tasks check `ticket.is_current()` before publishing
+    results so a stale result never reaches the user.
+    """
+
+    def __init__(self, max_workers=4, deadline_seconds=60):
+        self.deadline_seconds = deadline_seconds
+        self.counters = {'submitted': 0, 'superseded': 0, 'completed': 0, 'failed': 0}
+        self._current = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="latest-wins")
+
+    def current(self, key):
+        with self._lock:
+            return self._current.get(key)
+
+    def submit(self, key, fn):
+        """
+        Run fn(ticket) in the background, superseding any earlier task for `key`
+
+        Returns:
+            tuple: (ticket, superseded) where superseded is True if an earlier task was still running
+        """
+        ticket = Ticket(self, key, self.deadline_seconds)
+        with self._lock:
+            previous = self._current.get(key)
+            self._current[key] = ticket
+            self.counters['submitted'] += 1
+            superseded = previous is not None
+            if superseded:
+                self.counters['superseded'] += 1
+        if superseded:
+            logger.info(f"Task {previous.id} for '{key}' superseded by {ticket.id}")
+            previous.deadline.cancel()
+        self._executor.submit(self._run, ticket, fn)
+        return ticket, superseded
+
+    def _run(self, ticket, fn):
+        try:
+            fn(ticket)
+            outcome = 'completed'
+        except Exception as e:
+            logger.error(f"Background task {ticket.id} for '{ticket.key}' failed: {e}", exc_info=True)
+            outcome = 'failed'
+        with self._lock:
+            self.counters[outcome] += 1
+            # Forget finished tasks so a later submit does not count them as superseded
+            if self._current.get(ticket.key) is ticket:
+                del self._current[ticket.key]
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+            counters['in_flight'] = len(self._current)
+        return counters
@@ -0,0 +1,138 @@
+import time
+import hashlib
+import threading
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+
+class PromptPrefetcher:
+    """
+    Speculatively computes the reference-generation prompt right after a critique.
+
+    The image description and refined Imagen prompt are computed on a single
+    low-priority worker and kept against the snapshot, so a later Generate
+    Reference only has to pay for the Imagen call. Only the newest snapshot is
+    kept; results that are replaced without being used count as wasted, and
+    scheduling stops once the wasted calls in the last hour reach the budget.
+    """
+
+    def __init__(self, vision_api, enabled=True, waste_budget_per_hour=20, deadline_seconds=60):
+        """
+        Initialize the prefetcher
+
+        Args:
+            vision_api (VisionAPI): Client used for the description and refinement calls
+            enabled (bool): Whether speculative prefetching runs at all
+            waste_budget_per_hour (int): Max speculative API calls per hour that may go unused
+            deadline_seconds (float): Time budget for one speculative run
+        """
+        self.vision_api = vision_api
+        self.enabled = enabled
+        self.waste_budget_per_hour = waste_budget_per_hour
+        self.deadline_seconds = deadline_seconds
+        self.counters = {'scheduled': 0, 'completed': 0, 'used': 0, 'wasted_calls': 0, 'skipped_budget': 0}
+        self._entry = None
+        self._wasted_at = deque()
+        self._lock = threading.Lock()
+        # One worker: speculative work never competes with itself for API quota
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-prefetch")
+
+    @staticmethod
+    def _key(image_path, critique):
+        return image_path, hashlib.sha1(critique.encode('utf-8')).hexdigest()
+
+    def schedule(self, image_path, frame, critique):
+        """Start computing the description and refined prompt for a snapshot in the background."""
+        if not self.enabled:
+            return False
+        with self._lock:
+            self._retire(self._entry)
+            now = time.time()
+            while self._wasted_at and now - self._wasted_at[0] > 3600:
+                self._wasted_at.popleft()
+            if len(self._wasted_at) >= self.waste_budget_per_hour:
+                self.counters['skipped_budget'] += 1
+                self._entry = None
+                logger.info("Speculative prefetch skipped: hourly waste budget used up")
+                return False
+            entry = {
+                'key': self._key(image_path, critique),
+                'done': threading.Event(),
+                'deadline': Deadline(self.deadline_seconds),
+                'prompt': None,
+                'calls': 0,
+                'used': False,
+                'waiters': 0,  # take() calls waiting for this entry
+            }
+            self._entry = entry
+            self.counters['scheduled'] += 1
+        self._executor.submit(self._run, entry, frame, critique)
+        return True
+
+    def take(self, image_path, critique, timeout=None):
+        """
+        Claim the prefetched prompt for a snapshot, waiting for an in-flight prefetch if needed
+
+        Returns:
+            str | None: The refined image prompt, or None if nothing usable was prefetched
+        """
+        with self._lock:
+            entry = self._entry
+            if entry is None or entry['key'] != self._key(image_path, critique):
+                return None
+            entry['waiters'] += 1
+        done = entry['done'].wait(timeout)
+        with self._lock:
+            entry['waiters'] -= 1
+            if not done or entry['prompt'] is None or entry['used']:
+                if entry is not self._entry:
+                    # Replaced while we waited; the last waiter retires it instead of schedule()
+                    self._retire(entry)
+                return None
+            entry['used'] = True
+            self.counters['used'] += 1
+        logger.info("Using speculatively prefetched reference prompt")
+        return entry['prompt']
+
+    def _run(self, entry, frame, critique):
+        deadline = entry['deadline']
+        try:
+            if deadline.expired():
+                return
+            entry['calls'] += 1
+            desc_response = self.vision_api.get_image_description(frame, deadline=deadline)
+            description_text = desc_response.get('text', '')
+            if not description_text or "Error" in description_text or deadline.expired():
+                return
+            entry['calls'] += 1
+            prompt_response = self.vision_api.refine_generation_prompt(description_text, critique, deadline=deadline)
+            prompt = prompt_response.get('text', '')
+            if prompt and "Error" not in prompt:
+                with self._lock:
+                    entry['prompt'] = prompt
+                    self.counters['completed'] += 1
+        except Exception as e:
+            logger.error(f"Speculative prefetch failed: {e}", exc_info=True)
+        finally:
+            entry['done'].set()
+
+    def _retire(self, entry):
+        # Caller holds self._lock; count the calls of an unused entry as wasted.
+        # An entry a job is waiting for is left running; take() retires it if it goes unused.
+        if entry is None or entry['used'] or entry['waiters']:
+            return
+        entry['deadline'].cancel()
+        if entry['calls']:
+            self.counters['wasted_calls'] += entry['calls']
+            self._wasted_at.extend([time.time()] * entry['calls'])
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        counters['enabled'] = self.enabled
+        return counters
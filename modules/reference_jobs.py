@@ -0,0 +1,254 @@
+import os
+import time
+import uuid
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from modules.deadline import Deadline, DeadlineExceeded
+from modules.latency import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when too many reference jobs are already waiting."""
+
+
+class ReferenceJobManager:
+    """
+    Runs the description -> refine -> Imagen pipeline as background jobs.
+
+    Jobs run on a bounded worker pool. Every state change is pushed through the
+    `emit` callback (Socket.IO in the app) as a 'reference_job_progress' event, and
+    the finished image is announced with the existing 'reference_image_ready' event.
+    """
+
+    STAGES = ['description', 'refine', 'imagen']
+
+    def __init__(self, vision_api, imagen_client, emit, max_workers=2, max_queued=8, deadline_seconds=90, keep_jobs=50,
+                 prefetcher=None, on_success=None, prefetch_wait_share=0.15):
+        """
+        Initialize the job manager
+
+        Args:
+            vision_api (VisionAPI): Client used for the description and prompt refinement stages
+            imagen_client (VertexImagen): Client used for the image generation stage
+            emit (callable): emit(event, data) used to publish progress
+            max_workers (int): Number of jobs that may run at the same time
+            max_queued (int): Number of jobs that may wait for a worker
+            deadline_seconds (float): Time budget for one job, counted from when it starts running
+            keep_jobs (int): Number of finished jobs kept for status queries
+            prefetcher (PromptPrefetcher, optional): Source of speculatively computed prompts
+            prefetch_wait_share (float): Share of the budget a job may wait for an in-flight prefetch
+            on_success (callable, optional): on_success(snapshot_path, generated_path, prompt) after an image is generated
+        """
+        self.vision_api = vision_api
+        self.imagen_client = imagen_client
+        self.emit = emit
+        self.prefetcher = prefetcher
+        self.prefetch_wait_share = prefetch_wait_share
+        self.on_success = on_success
+        self.max_queued = max_queued
+        self.deadline_seconds = deadline_seconds
+        self.keep_jobs = keep_jobs
+        self.jobs = OrderedDict()
+        self.stage_latency = LatencyTracker()
+        self.counters = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'cancelled': 0, 'timed_out': 0, 'rejected': 0}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="reference-job")
+
+    def submit(self, image_path, critique):
+        """
+        Queue a reference generation job
+
+        Returns:
+            dict: Public view of the new job
+
+        Raises:
+            QueueFullError: If max_queued jobs are already waiting
+        """
+        with self._lock:
+            if self._count_state('queued') >= self.max_queued:
+                self.counters['rejected'] += 1
+                raise QueueFullError(f"{self.max_queued} reference jobs are already waiting")
+            job = {
+                'id': uuid.uuid4().hex[:12],
+                'state': 'queued',
+                'image_path': image_path,
+                'critique': critique,
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+                'deadline': None,
+                'cancel_requested': False,
+            }
+            self.jobs[job['id']] = job
+            self.counters['submitted'] += 1
+            self._trim()
+        self._publish(job)
+        self._executor.submit(self._run, job)
+        logger.info(f"Reference job {job['id']} queued")
+        return self._public(job)
+
+    def get(self, job_id):
+        """Return the public view of a job, or None if it is unknown."""
+        with self._lock:
+            job = self.jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or running job
+
+        Returns:
+            bool: False if the job is unknown or already finished
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if not job or job['state'] in ('succeeded', 'failed', 'cancelled', 'timed_out'):
+                return False
+            job['cancel_requested'] = True
+            if job['deadline'] is not None:
+                job['deadline'].cancel()
+        logger.info(f"Reference job {job_id} cancellation requested")
+        return True
+
+    def stats(self):
+        """Queue depth, job counters and per-stage durations."""
+        with self._lock:
+            counters = dict(self.counters)
+            counters['queued'] = self._count_state('queued')
+            counters['running'] = sum(1 for job in self.jobs.values() if job['state'] in self.STAGES)
+        counters['stage_latency'] = self.stage_latency.summary()
+        return counters
+
+    def _run(self, job):
+        with self._lock:
+            cancelled = job['cancel_requested']
+            if cancelled:
+                self._finish(job, 'cancelled', error="Cancelled before start")
+            else:
+                job['started_at'] = time.time()
+                job['deadline'] = Deadline(self.deadline_seconds, planned_stages=self.STAGES)
+        if cancelled:
+            self._publish(job)
+            return
+        self.stage_latency.record('queue_wait', job['started_at'] - job['created_at'])
+        deadline = job['deadline']
+        succeeded = False
+
+        try:
+            with open(job['image_path'], "rb") as f:
+                img_bytes = f.read()
+            frame = cv2.imdecode(np.frombuffer(img_bytes, np.uint8), cv2.IMREAD_COLOR)
+            if frame is None:
+                raise ValueError("Failed to process snapped image.")
+
+            final_image_prompt = None
+            if self.prefetcher is not None:
+                # Waiting is capped so a slow prefetch leaves enough budget to build the prompt here
+                with deadline.stage('prefetch_wait'):
+                    final_image_prompt = self.prefetcher.take(
+                        job['image_path'], job['critique'],
+                        timeout=deadline.timeout(self.deadline_seconds * self.prefetch_wait_share))
+            if final_image_prompt:
+                deadline.skip('description', 'prefetched')
+                deadline.skip('refine', 'prefetched')
+            else:
+                final_image_prompt = self._build_prompt(job, frame, deadline)
+
+            self._set_state(job, 'imagen')
+            with deadline.stage('imagen'):
+                generated_image_path = self.imagen_client.generate_image_from_text(
+                    prompt=final_image_prompt,
+                    output_dir="generated_images",
+                    filename_prefix=f"reference_{job['id']}",  # Unique per job; jobs run in parallel
+                    deadline=deadline
+                )
+            if not generated_image_path:
+                raise ValueError("Failed to generate reference image using AI.")
+
+            relative_path = os.path.relpath(generated_image_path, start=os.getcwd())
+            web_path = f"/{relative_path.replace(os.sep, '/')}"
+            with self._lock:
+                job['result'] = {'image_path': web_path, 'prompt': final_image_prompt}
+                self._finish(job, 'succeeded')
+            succeeded = True
+            self.emit('reference_image_ready', {'image_path': web_path, 'job_id': job['id']})
+        except DeadlineExceeded as e:
+            with self._lock:
+                self._finish(job, 'cancelled' if deadline.cancelled else 'timed_out', error=str(e))
+        except Exception as e:
+            logger.error(f"Reference job {job['id']} failed: {e}", exc_info=True)
+            with self._lock:
+                self._finish(job, 'failed', error=str(e))
+        finally:
+            for stage in deadline.report()['stages']:
+                if stage['status'] == 'ok':
+                    self.stage_latency.record(stage['name'], stage['seconds'])
+            self._publish(job)
+
+        if succeeded and self.on_success is not None:
+            # The job already succeeded; a failing callback must not change its outcome
+            try:
+                self.on_success(job['image_path'], relative_path, final_image_prompt)
+            except Exception as e:
+                logger.error(f"Reference job {job['id']} success callback failed: {e}", exc_info=True)
+
+    def _build_prompt(self, job, frame, deadline):
+        """Run the description and refinement stages and return the Imagen prompt."""
+        self._set_state(job, 'description')
+        with deadline.stage('description'):
+            desc_response = self.vision_api.get_image_description(frame, deadline=deadline)
+        description_text = desc_response.get('text', '')
+        if not description_text or "Error" in description_text:
+            raise ValueError(f"Failed to get image description: {description_text}")
+        logger.info(f"Image Description: {description_text[:100]}...")
+
+        self._set_state(job, 'refine')
+        with deadline.stage('refine'):
+            prompt_response = self.vision_api.refine_generation_prompt(description_text, job['critique'], deadline=deadline)
+        final_image_prompt = prompt_response.get('text', '')
+        if not final_image_prompt or "Error" in final_image_prompt:
+            raise ValueError(f"Failed to refine generation prompt: {final_image_prompt}")
+        logger.info(f"Final Image Generation Prompt: {final_image_prompt}")
+        return final_image_prompt
+
+    def _set_state(self, job, state):
+        with self._lock:
+            job['state'] = state
+        self._publish(job)
+
+    def _finish(self, job, state, error=None):
+        # Caller holds self._lock
+        job['state'] = state
+        job['error'] = error
+        job['finished_at'] = time.time()
+        self.counters[state] += 1
+        logger.info(f"Reference job {job['id']} {state}" + (f": {error}" if error else ""))
+
+    def _publish(self, job):
+        with self._lock:
+            data = self._public(job)
+        self.emit('reference_job_progress', data)
+
+    def _public(self, job):
+        data = {key: job[key] for key in ('id', 'state', 'created_at', 'started_at', 'finished_at', 'result', 'error')}
+        data['timing'] = job['deadline'].report() if job['deadline'] is not None else None
+        return data
+
+    def _count_state(self, state):
+        return sum(1 for job in self.jobs.values() if job['state'] == state)
+
+    def _trim(self):
+        # Caller holds self._lock; drop the oldest finished jobs beyond keep_jobs
+        finished = [job_id for job_id, job in self.jobs.items() if job['finished_at'] is not None]
+        for job_id in finished[:max(0, len(self.jobs) - self.keep_jobs)]:
+            del self.jobs[job_id]
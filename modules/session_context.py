@@ -0,0 +1,160 @@
+import os
+import math
+import base64
+import threading
+import logging
+
+from modules.text_pipeline import TextPipeline
+
+logger = logging.getLogger(__name__)
+
+
+class SessionContext:
+    """
+    Conversation context of a critique session, kept within a token budget.
+
+    Every critique becomes a pair of turns: the user asking for a critique
+    (optionally with a thumbnail of the snapshot) and the model's reply. The
+    turns are sent with the next request, so the model sees what it already
+    said. Once the estimated size of the context exceeds `max_tokens`, older
+    turns are compacted: thumbnails are dropped first, then the oldest turns
+    are folded into a short summary of their suggestions, which is added to
+    the prompt. The context sent with each request therefore stops growing,
+    and so do latency and cost, however long the session runs.
+    """
+
+    CHARS_PER_TOKEN = 4  # Rough average for English text
+    TURN_OVERHEAD = 4  # Tokens for the role and framing of each turn
+
+    def __init__(self, max_tokens=None, include_images=None, keep_recent=2, summary_items=8, image_tokens=258):
+        """
+        Initialize an empty session
+
+        Args:
+            max_tokens (int, optional): Token budget of the turns and summary; defaults to SESSION_CONTEXT_TOKENS
+            include_images (bool, optional): Send snapshot thumbnails with the turns; defaults to SESSION_CONTEXT_IMAGES
+            keep_recent (int): Number of most recent critiques never folded into the summary
+            summary_items (int): Max suggestions kept in the summary of older critiques
+            image_tokens (int): Estimated tokens of one thumbnail
+        """
+        if max_tokens is None:
+            max_tokens = int(os.getenv('SESSION_CONTEXT_TOKENS', '3000'))
+        if include_images is None:
+            include_images = os.getenv('SESSION_CONTEXT_IMAGES', 'false').lower() == 'true'
+        self.max_tokens = max_tokens
+        self.include_images = include_images
+        self.keep_recent = keep_recent
+        self.summary_items = summary_items
+        self.image_tokens = image_tokens
+        self.pipeline = TextPipeline()
+        self.counters = {'critiques': 0, 'compacted': 0, 'images_dropped': 0}
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget the session; the next critique starts without context."""
+        with self._lock:
+            self._critiques = []  # [{'text', 'image', 'tokens'}] oldest first
+            self._summary = {}  # Suggestion -> None, oldest first
+            self._tokens = 0
+
+    @classmethod
+    def estimate_tokens(cls, text):
+        """Estimate the number of tokens of a text without a tokenizer."""
+        return math.ceil(len(text) / cls.CHARS_PER_TOKEN) if text else 0
+
+    def _cost(self, critique):
+        cost = 2 * self.TURN_OVERHEAD + self.estimate_tokens(critique['text'])
+        return cost + (self.image_tokens if critique['image'] else 0)
+
+    def add(self, critique_text, thumbnail_jpeg=None):
+        """
+        Record a critique as the latest turn, compacting older turns if over budget
+
+        Args:
+            critique_text (str): The model's critique
+            thumbnail_jpeg (bytes, optional): JPEG thumbnail of the critiqued snapshot
+        """
+        critique = {
+            'text': critique_text,
+            'image': base64.b64encode(thumbnail_jpeg).decode('utf-8') if thumbnail_jpeg and self.include_images else None,
+        }
+        critique['tokens'] = self._cost(critique)
+        with self._lock:
+            self._critiques.append(critique)
+            self._tokens += critique['tokens']
+            self.counters['critiques'] += 1
+            self._compact()
+
+    def _compact(self):
+        # Caller holds self._lock
+        # Thumbnails cost the most for the least benefit, so they go first, oldest first
+        for critique in self._critiques[:-1]:
+            if self._tokens <= self.max_tokens:
+                return
+            if critique['image']:
+                critique['image'] = None
+                self._tokens -= self.image_tokens
+                critique['tokens'] -= self.image_tokens
+                self.counters['images_dropped'] += 1
+        while self._tokens > self.max_tokens and len(self._critiques) > self.keep_recent:
+            oldest = self._critiques.pop(0)
+            self._tokens -= oldest['tokens']
+            self.counters['compacted'] += 1
+            suggestions = self.pipeline.insights(oldest['text'])['suggestions']
+            if not suggestions:
+                sentences = self.pipeline.sentences(self.pipeline.speech_text(oldest['text']))
+                suggestions = sentences[:1]
+            self._tokens -= self._summary_tokens()
+            for suggestion in suggestions:
+                self._summary.pop(suggestion, None)
+                self._summary[suggestion] = None  # Repeated advice moves to the newest end
+            while len(self._summary) > self.summary_items:
+                self._summary.pop(next(iter(self._summary)))
+            self._tokens += self._summary_tokens()
+
+    def _summary_tokens(self):
+        return sum(self.estimate_tokens(item) + 1 for item in self._summary)
+
+    def prompt(self, system_prompt):
+        """
+        The system prompt for the next critique, with follow-up instructions once the session has context
+
+        Args:
+            system_prompt (str): The configured critique prompt
+
+        Returns:
+            str: Prompt text
+        """
+        with self._lock:
+            if not self._critiques:
+                return system_prompt
+            summary = list(self._summary)
+        text = (f"{system_prompt}\n\nThe earlier turns are your previous critiques of this drawing in this session. "
+                "Continue with brief, actionable feedback: only mention new or ongoing improvements.")
+        if summary:
+            text += "\nBefore those, you had suggested:\n" + "\n".join(f"- {item}" for item in summary)
+        return text
+
+    def history(self):
+        """
+        Conversation turns of the session, oldest first
+
+        Returns:
+            list: [{"role": "user" | "model", "parts": [...]}], in the format VisionAPI providers accept
+        """
+        with self._lock:
+            critiques = list(self._critiques)
+        turns = []
+        for critique in critiques:
+            parts = [{"text": "Please critique my drawing."}]
+            if critique['image']:
+                parts.append({"inline_data": {"mime_type": "image/jpeg", "data": critique['image']}})
+            turns.append({"role": "user", "parts": parts})
+            turns.append({"role": "model", "parts": [{"text": critique['text']}]})
+        return turns
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, turns=len(self._critiques), summary_items=len(self._summary),
+                        estimated_tokens=self._tokens, max_tokens=self.max_tokens)
@@ -0,0 +1,77 @@
+import cv2
+import numpy as np
+
+# Frames are downscaled to this width before measuring, which keeps every
+# metric in the low milliseconds even for full HD camera frames.
+ANALYSIS_WIDTH = 320
+GRID_SIZE = 8
+
+
+def compute_sketch_metrics(frame):
+    """
+    Compute cheap structural metrics for a drawing, entirely locally.
+
+    Args:
+        frame (numpy.ndarray): BGR or grayscale camera frame
+
+    Returns:
+        dict: ink_coverage, edge_density, stroke_width_median, stroke_width_p90,
+            stroke_width_variation, symmetry and blank_region_ratio (all floats)
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height, width = gray.shape[:2]
+    if width > ANALYSIS_WIDTH:
+        gray = cv2.resize(gray, (ANALYSIS_WIDTH, int(height * ANALYSIS_WIDTH / width)), interpolation=cv2.INTER_AREA)
+    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+
+    # Ink: pixels noticeably darker than their neighbourhood, robust to uneven lighting
+    ink = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 15, 10)
+    ink_mask = ink > 0
+    ink_coverage = float(ink_mask.mean())
+
+    edges = cv2.Canny(blurred, 50, 150)
+    edge_density = float(np.count_nonzero(edges)) / edges.size
+
+    # Line weight: twice the distance to the nearest background pixel, sampled on stroke ridges
+    dist = cv2.distanceTransform(ink, cv2.DIST_L2, 3)
+    ridges = ink_mask & (dist >= cv2.dilate(dist, np.ones((3, 3), np.uint8)))
+    widths = 2.0 * dist[ridges]
+    if widths.size:
+        stroke_width_median = float(np.median(widths))
+        stroke_width_p90 = float(np.percentile(widths, 90))
+        stroke_width_variation = float(widths.std() / widths.mean()) if widths.mean() > 0 else 0.0
+    else:
+        stroke_width_median = stroke_width_p90 = stroke_width_variation = 0.0
+
+    # Left/right mirror symmetry as intersection-over-union of the ink mask and its mirror
+    mirrored = ink_mask[:, ::-1]
+    union = np.count_nonzero(ink_mask | mirrored)
+    symmetry = float(np.count_nonzero(ink_mask & mirrored)) / union if union else 0.0
+
+    # Blank regions: grid cells with (almost) no ink
+    rows, cols = ink_mask.shape
+    cell_h, cell_w = rows // GRID_SIZE, cols // GRID_SIZE
+    cells = ink_mask[:cell_h * GRID_SIZE, :cell_w * GRID_SIZE].reshape(GRID_SIZE, cell_h, GRID_SIZE, cell_w)
+    cell_coverage = cells.mean(axis=(1, 3))
+    blank_region_ratio = float((cell_coverage < 0.005).mean())
+
+    return {
+        'ink_coverage': round(ink_coverage, 4),
+        'edge_density': round(edge_density, 4),
+        'stroke_width_median': round(stroke_width_median, 2),
+        'stroke_width_p90': round(stroke_width_p90, 2),
+        'stroke_width_variation': round(stroke_width_variation, 3),
+        'symmetry': round(symmetry, 3),
+        'blank_region_ratio': round(blank_region_ratio, 3),
+    }
+
+
+def format_hints(metrics):
+    """Render metrics as a compact hint line to append to a critique prompt."""
+    return (
+        "Local pre-analysis (approximate, do not restate): "
+        f"ink {metrics['ink_coverage']:.1%}, edges {metrics['edge_density']:.1%}, "
+        f"stroke width median {metrics['stroke_width_median']:.1f}px p90 {metrics['stroke_width_p90']:.1f}px "
+        f"(variation {metrics['stroke_width_variation']:.2f}), "
+        f"left-right symmetry {metrics['symmetry']:.2f}, blank regions {metrics['blank_region_ratio']:.0%}."
+    )
@@ -0,0 +1,118 @@
+import time
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StartupOrchestrator:
+    """
+    Initializes independent components concurrently and tracks their readiness.
+
+    Each component is built by its factory on its own thread. Critical
+    components must be ready before the server starts accepting connections;
+    the others finish in the background and are looked up with `get()`, which
+    returns None until they are ready.
+    """
+
+    def __init__(self):
+        self.components = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, critical=True, timeout=30):
+        """
+        Register a component
+
+        Args:
+            name (str): Component name used in reports and lookups
+            factory (callable): Builds and returns the component instance
+            critical (bool): Whether the server needs it before accepting connections
+            timeout (float): Seconds after which a still-running initialization counts as timed out
+        """
+        self.components[name] = {
+            'factory': factory,
+            'critical': critical,
+            'timeout': timeout,
+            'state': 'pending',
+            'instance': None,
+            'error': None,
+            'started_at': None,
+            'seconds': None,
+            'done': threading.Event(),
+        }
+
+    def start(self):
+        """Start initializing every registered component in parallel."""
+        for name, component in self.components.items():
+            component['started_at'] = time.time()
+            component['state'] = 'initializing'
+            threading.Thread(target=self._init_component, args=(name, component),
+                             name=f"startup-{name}", daemon=True).start()
+
+    def _init_component(self, name, component):
+        try:
+            instance = component['factory']()
+            with self._lock:
+                component['instance'] = instance
+                component['state'] = 'ready'
+        except Exception as e:
+            logger.error(f"Failed to initialize {name}: {e}", exc_info=True)
+            with self._lock:
+                component['state'] = 'failed'
+                component['error'] = str(e)
+        finally:
+            component['seconds'] = round(time.time() - component['started_at'], 3)
+            logger.info(f"Component '{name}' {component['state']} after {component['seconds']}s")
+            component['done'].set()
+
+    def wait_for_critical(self):
+        """
+        Block until every critical component is ready, failed or timed out
+
+        Returns:
+            bool: True if all critical components are ready
+        """
+        ok = True
+        for name, component in self.components.items():
+            if not component['critical']:
+                continue
+            remaining = component['timeout'] - (time.time() - component['started_at'])
+            if not component['done'].wait(max(0.0, remaining)):
+                logger.error(f"Critical component '{name}' did not initialize within {component['timeout']}s")
+            if self._state(component) != 'ready':
+                ok = False
+        return ok
+
+    def get(self, name):
+        """Return the component instance, or None if it is not ready (yet)."""
+        component = self.components.get(name)
+        if component is None:
+            return None
+        with self._lock:
+            return component['instance'] if component['state'] == 'ready' else None
+
+    def is_ready(self):
+        """True once every critical component is ready."""
+        return all(self._state(c) == 'ready' for c in self.components.values() if c['critical'])
+
+    def _state(self, component):
+        with self._lock:
+            state = component['state']
+        if state == 'initializing' and time.time() - component['started_at'] > component['timeout']:
+            return 'timed_out'
+        return state
+
+    def report(self):
+        """Component states and initialization times."""
+        report = {}
+        for name, component in self.components.items():
+            seconds = component['seconds']
+            if seconds is None and component['started_at'] is not None:
+                seconds = round(time.time() - component['started_at'], 3)
+            report[name] = {
+                'state': self._state(component),
+                'critical': component['critical'],
+                'seconds': seconds,
+                'error': component['error'],
+            }
+        return report
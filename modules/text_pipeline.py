@@ -0,0 +1,105 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Patterns are compiled once at import and shared by every TextPipeline
+EXTRA_NEWLINES = re.compile(r'\n{3,}')
+PREAMBLE = re.compile(r'^(I can see that|Looking at your drawing|Based on the image|From what I can observe)')
+# Images are removed, links keep their text and formatting characters are dropped, in a single substitution
+MARKDOWN = re.compile(r'!\[[^\]]*\]\([^)]*\)|\[([^\]]*)\]\([^)]*\)|[`*_>#\-]')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+# Every insight cue, tried at each word start in one scan. The cues are lookaheads, so
+# they consume nothing and a technique mentioned inside a suggestion is still found.
+# Techniques are found at the word "technique"; the two words before it are then read
+# back with TECHNIQUE_NAME, which is cheaper than trying two words ahead at every word.
+INSIGHT_CUES = re.compile(r"""
+    \b(?=[stciy])(?=  # Only words starting like a cue word are tried
+        (?P<suggestion>(?:suggest|try|consider)[^.!?]*[.!?])
+      | (?P<technique>technique)(?:\ of\ (?P<technique_of>\w+\s\w+))?
+      | I\ (?:see|notice)\ (?P<seen>\w+)
+      | there\ is\ (?P<there_is>\w+\s\w+)
+      | you've\ drawn\ (?P<drawn>\w+\s\w+)
+    )""", re.IGNORECASE | re.VERBOSE)
+TECHNIQUE_NAME = re.compile(r'(\w+\s\w+) $')
+TECHNIQUE_LOOKBACK = 80  # Characters searched for the two words before "technique"
+
+
+class TextPipeline:
+    """
+    Turns a critique into everything the app needs from it.
+
+    One call produces the cleaned display text, the text to speak (markdown
+    removed), its sentences, and the insights (techniques, suggestions,
+    detected elements). The insights come from a single scan with one
+    combined pattern instead of one regex pass per cue, and all patterns are
+    compiled once at import.
+    """
+
+    CATEGORIES = ['techniques', 'suggestions', 'detected_elements']
+
+    def process(self, text):
+        """
+        Process a raw critique
+
+        Args:
+            text (str): Critique text as returned by the vision API
+
+        Returns:
+            dict: 'text' (display), 'speech_text', 'sentences' and 'insights' (category -> unique items)
+        """
+        text = self.clean(text)
+        speech_text = self.speech_text(text)
+        return {
+            'text': text,
+            'speech_text': speech_text,
+            'sentences': self.sentences(speech_text),
+            'insights': self.insights(text),
+        }
+
+    @staticmethod
+    def clean(text):
+        """Collapse runs of blank lines and drop a leading AI preamble."""
+        text = EXTRA_NEWLINES.sub('\n\n', text)
+        return PREAMBLE.sub('', text).strip()
+
+    @staticmethod
+    def speech_text(text):
+        """Text with markdown removed, for text-to-speech."""
+        return MARKDOWN.sub(lambda m: m.group(1) or '', text).strip()
+
+    @staticmethod
+    def sentences(text):
+        """Non-empty sentences of the text, in order."""
+        return [s.strip() for s in SENTENCE_END.split(text) if s.strip()]
+
+    def insights(self, text):
+        """
+        Extract insights with one scan of the text
+
+        Args:
+            text (str): Cleaned critique text
+
+        Returns:
+            dict: Category -> list of unique items in order of appearance
+        """
+        found = {category: {} for category in self.CATEGORIES}
+        suggestion_end = 0
+        for match in INSIGHT_CUES.finditer(text):
+            start = match.start()
+            group = match.lastgroup
+            if group == 'suggestion':
+                suggestion = match.group(group)
+                # A cue word inside an earlier suggestion does not start a new one
+                if start >= suggestion_end:
+                    found['suggestions'][suggestion] = None
+                    suggestion_end = start + len(suggestion)
+            elif group in ('technique', 'technique_of'):
+                name = TECHNIQUE_NAME.search(text, max(0, start - TECHNIQUE_LOOKBACK), start)
+                if name:
+                    found['techniques'][name.group(1)] = None
+                if match.group('technique_of'):
+                    found['techniques'][match.group('technique_of')] = None
+            else:
+                found['detected_elements'][match.group(group)] = None
+        return {category: list(items) for category, items in found.items()}
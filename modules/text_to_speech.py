@@ -1,120 +1,387 @@
 import pyttsx3
 import logging
 import threading
+import itertools
+import queue
+import tempfile
 import os
 import time
 
+from modules.latency import LatencyTracker
+from modules.audio_cache import AudioCache
+from modules.audio_player import AudioPlayer
+from modules.text_pipeline import TextPipeline
+
 logger = logging.getLogger(__name__)
 
+# Queue priorities: lower numbers are spoken first
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 5
+PRIORITY_LOW = 9
+
+def split_sentences(text, min_chars=40):
+    """
+    Split text into chunks of whole sentences for pipelined synthesis
+
+    The first sentence is kept on its own so audio can start as early as
+    possible; later sentences shorter than min_chars are merged with the next.
+
+    Returns:
+        list: Non-empty text chunks in order
+    """
+    sentences = TextPipeline.sentences(text)
+    chunks = []
+    for sentence in sentences:
+        if len(chunks) > 1 and len(chunks[-1]) < min_chars:
+            chunks[-1] = f"{chunks[-1]} {sentence}"
+        else:
+            chunks.append(sentence)
+    return chunks
+
 class TextToSpeech:
-    """Class to handle text-to-speech conversion"""
-    
-    def __init__(self, voice_id=None, rate=150, volume=0.8):
+    """
+    Class to handle text-to-speech conversion
+
+    A single long-lived worker thread owns the pyttsx3 engine and speaks
+    messages from a priority queue. Other threads never touch the engine:
+    property changes are applied by the worker before the next utterance, and
+    cancellation is signalled with a flag that the worker checks from the
+    engine's word callback, where `engine.stop()` is safe to call.
+
+    With an AudioCache, or with sentence pipelining, text is rendered to audio
+    files and played through an AudioPlayer; repeated text is played from the
+    cache without the engine. Pipelining splits a message into sentences and
+    renders the next sentence while the previous one plays.
+    """
+
+    def __init__(self, voice_id=None, rate=150, volume=0.8, max_age=None, audio_cache=None, pipeline=None):
         """
         Initialize the TTS engine
-        
+
         Args:
             voice_id (str, optional): Voice ID to use
             rate (int): Speech rate (words per minute)
             volume (float): Volume level (0.0 to 1.0)
+            max_age (float, optional): Seconds a message played here may wait in the queue before it is dropped
+                as stale (delivered messages are only superseded)
+            audio_cache (AudioCache, optional): Cache of synthesized audio; enables synthesize-then-play mode
+            pipeline (bool, optional): Whether to synthesize sentence by sentence (default: TTS_SENTENCE_PIPELINE)
         """
         self.engine = None
         self.voice_id = voice_id
         self.rate = rate
         self.volume = volume
         self.enabled = os.getenv('TTS_ENABLED', 'true').lower() == 'true'
-        self.speaking_thread = None
-        self.engine_lock = threading.Lock()  # Use a lock to prevent multiple threads trying to use runAndWait simultaneously
-        self.stop_requested = threading.Event()
-        
+        self.max_age = max_age if max_age is not None else float(os.getenv('TTS_MAX_QUEUE_AGE', '15'))
+        self.voices = []
+        self.pipeline = pipeline if pipeline is not None else os.getenv('TTS_SENTENCE_PIPELINE', 'true').lower() == 'true'
+        self.audio_cache = audio_cache
+        self.player = AudioPlayer() if audio_cache is not None or self.pipeline else None
+        if self.player is not None and not self.player.available:
+            self.audio_cache = self.player = None
+        self.last_utterance = None
+        self._rendering = False  # True while the engine writes to a file rather than the speakers
+        self.latency = LatencyTracker()
+        self.counters = {'queued': 0, 'spoken': 0, 'superseded': 0, 'dropped_stale': 0, 'cancelled': 0, 'failed': 0}
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._generation = 0  # Bumped to supersede everything queued or playing
+        self._keys = {}  # Listener key -> {'generation', 'pending'}, kept while the key has messages
+        self._current = None
+        self._pending_properties = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="tts-worker", daemon=True)
+        self._worker.start()
+        self._ready.wait()
+        if self.engine is None:
+            self.enabled = False
+
+    def _init_engine(self):
+        # Runs on the worker thread: some pyttsx3 drivers are bound to the thread that created them
         try:
             self.engine = pyttsx3.init()
-            
+
             # Configure voice properties
             self.engine.setProperty('rate', self.rate)
             self.engine.setProperty('volume', self.volume)
-            
+
             # Set voice if specified, otherwise use system default
-            if voice_id:
-                self.engine.setProperty('voice', voice_id)
-            
+            if self.voice_id:
+                self.engine.setProperty('voice', self.voice_id)
+
+            self.voices = [{"name": v.name, "id": v.id} for v in self.engine.getProperty('voices')]
+            self.engine.connect('started-utterance', self._on_started_utterance)
+            self.engine.connect('started-word', self._on_started_word)
             logger.info("Text-to-speech engine initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize text-to-speech engine: {e}")
-            self.enabled = False
-    
-    def speak(self, text, async_mode=True):
+            self.engine = None
+
+    def speak(self, text, async_mode=True, priority=PRIORITY_NORMAL, supersede=True, max_age=None, key=None,
+              deliver=None):
         """
-        Convert text to speech
-        
+        Queue text to be spoken
+
         Args:
             text (str): Text to convert to speech
-            async_mode (bool): Whether to run in async mode
+            async_mode (bool): Whether to return immediately instead of waiting until it was spoken
+            priority (int): Queue priority, lower is spoken first
+            supersede (bool): Whether to cancel the current utterance and everything still queued (for `key`)
+            max_age (float, optional): Seconds after which the message is dropped if still queued (not with deliver)
+            key (str, optional): Listener the message is for; superseding then only affects that listener
+            deliver (callable, optional): deliver(path, temporary, index, final) called with each rendered
+                chunk instead of playing it locally; the callee owns temporary files
+
+        Returns:
+            bool: Whether the message was queued (in sync mode: whether it was spoken)
         """
         if not self.enabled or not self.engine:
             logger.warning("TTS is disabled or not properly initialized")
             return False
 
-        # Stop any currently speaking thread (simple version)
+        if supersede:
+            self.stop_speech(reason='superseded', key=key)
+
+        now = time.time()
+        with self._lock:
+            key_state = None
+            if key is not None:
+                key_state = self._keys.setdefault(key, {'generation': 0, 'pending': 0})
+                key_state['pending'] += 1
+            message = {
+                'text': text,
+                'key': key,
+                'deliver': deliver,
+                'generation': self._generation,
+                'key_state': key_state,
+                'key_generation': key_state['generation'] if key_state else 0,
+                'enqueued_at': now,
+                'expires_at': now + (max_age if max_age is not None else self.max_age),
+                'first_audio_at': None,
+                'status': 'queued',
+                'done': threading.Event(),
+            }
+            self.counters['queued'] += 1
+        self._queue.put((priority, next(self._sequence), message))
+        logger.info(f"Queued speech (priority {priority}, depth {self._queue.qsize()}): '{text[:30]}...'")
+
+        if async_mode:
+            return True
+        message['done'].wait()
+        return message['status'] == 'spoken'
+
+    def stop_speech(self, reason='cancelled', key=None):
+        """Cancel the current utterance and drop everything still queued, for one listener `key` or for all."""
+        with self._lock:
+            if key is None:
+                self._generation += 1
+            elif key in self._keys:
+                self._keys[key]['generation'] += 1
+            current = self._current
+            if current is not None and current['status'] == 'speaking' and key in (None, current['key']):
+                current['status'] = reason
+            else:
+                current = None
+        if current is not None:
+            logger.info(f"Speech {reason}: '{current['text'][:30]}...'")
+
+    def forget(self, key):
+        """Cancel everything for a listener that has gone away and drop its state."""
+        self.stop_speech(key=key)
+        with self._lock:
+            self._keys.pop(key, None)
+
+    def close(self, timeout=2):
+        """Stop speaking and shut down the worker thread."""
         self.stop_speech()
-        
+        self._queue.put((-1, next(self._sequence), None))
+        self._worker.join(timeout)
+
+    def _run(self):
+        self._init_engine()
+        self._ready.set()
+        while True:
+            _, _, message = self._queue.get()
+            if message is None:
+                break
+            if self.engine is None:
+                self._finish(message, 'failed')
+                continue
+            key_state = message['key_state']
+            with self._lock:
+                if (message['generation'] != self._generation
+                        or (key_state is not None and (self._keys.get(message['key']) is not key_state
+                                                       or message['key_generation'] != key_state['generation']))):
+                    status = 'superseded'
+                elif message['deliver'] is None and time.time() > message['expires_at']:
+                    # The queue-age limit is for the speakers; a delivered render only yields to newer ones for its key
+                    status = 'dropped_stale'
+                else:
+                    status = None
+                    message['status'] = 'speaking'
+                    self._current = message
+            if status:
+                self._finish(message, status)
+                continue
+            self._speak_message(message)
+
+    def _speak_message(self, message):
+        started = time.time()
+        self.latency.record('queue_wait', started - message['enqueued_at'])
+        chunks = split_sentences(message['text']) if self.pipeline else [message['text']]
         try:
-            if async_mode:
-                # Ensure previous thread is finished before starting a new one
-                if self.speaking_thread and self.speaking_thread.is_alive():
-                    logger.info("Waiting for previous TTS thread to finish...")
-                    self.speaking_thread.join(timeout=0.5)  # Wait briefly
-
-                logger.info(f"Starting new TTS thread for: '{text[:30]}...'")
-                self.speaking_thread = threading.Thread(target=self._speak_thread, args=(text,))
-                self.speaking_thread.daemon = True
-                self.speaking_thread.start()
-                return True
+            self._apply_pending_properties()
+            if message['deliver'] is not None:
+                self._synthesize_and_deliver(message, chunks)
+            elif self.player is not None:
+                self._synthesize_and_play(message, chunks)
             else:
-                # Synchronous mode
-                with self.engine_lock:  # Protect synchronous calls too
-                    logger.info(f"Speaking synchronously: '{text[:30]}...'")
-                    self.engine.say(text)
-                    self.engine.runAndWait()
-                    logger.info("Synchronous speech finished.")
-                return True
+                # Separate utterances let the word callback stop between sentences
+                for chunk in chunks:
+                    self.engine.say(chunk)
+                self.engine.runAndWait()
+            status = 'spoken' if message['status'] == 'speaking' else message['status']
         except Exception as e:
-            logger.error(f"Error starting text-to-speech: {e}")
-            return False
+            logger.error(f"Error in TTS worker: {e}")
+            status = 'failed'
+        with self._lock:
+            self._current = None
+        finished = time.time()
+        if status == 'spoken':
+            self.latency.record('speech', finished - (message['first_audio_at'] or started))
+        first_audio_at = message['first_audio_at']
+        self.last_utterance = {
+            'status': status,
+            'chars': len(message['text']),
+            'chunks': len(chunks),
+            'time_to_first_audio': round(first_audio_at - message['enqueued_at'], 3) if first_audio_at else None,
+            'speech_seconds': round(finished - first_audio_at, 3) if first_audio_at else None,
+        }
+        logger.info(f"Utterance {status}: {self.last_utterance}")
+        self._finish(message, status)
 
-    def stop_speech(self):
-        """Stop any currently playing speech (simple version)."""
+    def _synthesize_and_play(self, message, chunks):
+        """Render chunks one by one on this thread while a player thread plays the finished ones."""
+        playback = queue.Queue()
+        player_thread = threading.Thread(target=self._play_chunks, args=(message, playback),
+                                         name="tts-player", daemon=True)
+        player_thread.start()
         try:
-            # This might interrupt the current utterance
-            self.engine.stop()
-            logger.info("Called engine.stop()")
-        except Exception as e:
-            logger.error(f"Error calling engine.stop(): {e}")
-        # We don't explicitly manage the thread stop here anymore,
-        # relying on the next speak call or thread completion.
-
-    def _speak_thread(self, text):
-        """Thread target for asynchronous speech."""
-        # Acquire lock to ensure only one thread uses runAndWait at a time
-        acquired = self.engine_lock.acquire(timeout=0.1)  # Try to acquire lock briefly
-        if not acquired:
-            logger.warning("Could not acquire TTS engine lock, skipping speech.")
-            return
+            for chunk in chunks:
+                if message['status'] != 'speaking':
+                    break
+                playback.put(self._synthesize(chunk))
+        finally:
+            playback.put(None)
+            player_thread.join()
+
+    def _synthesize_and_deliver(self, message, chunks):
+        """Render chunks one by one and hand each to the message's deliver callback."""
+        for index, chunk in enumerate(chunks):
+            if message['status'] != 'speaking':
+                break
+            path, temporary = self._synthesize(chunk)
+            self._mark_first_audio(message)
+            message['deliver'](path, temporary, index, index == len(chunks) - 1)
+
+    def _play_chunks(self, message, playback):
+        while True:
+            item = playback.get()
+            if item is None:
+                return
+            path, temporary = item
+            try:
+                if message['status'] == 'speaking':
+                    self._mark_first_audio(message)
+                    self.player.play(path, should_stop=lambda: message['status'] != 'speaking')
+            except Exception as e:
+                logger.error(f"Error playing speech: {e}")
+                message['status'] = 'failed'
+            finally:
+                if temporary:
+                    os.remove(path)
 
+    def _finish(self, message, status):
+        with self._lock:
+            message['status'] = status
+            counter = 'cancelled' if status not in self.counters else status
+            self.counters[counter] += 1
+            key_state = message['key_state']
+            if key_state is not None:
+                key_state['pending'] -= 1
+                if not key_state['pending'] and self._keys.get(message['key']) is key_state:
+                    del self._keys[message['key']]
+        message['done'].set()
+
+    def _synthesize(self, text):
+        """
+        Get an audio file for text, from the cache or rendered by the engine
+
+        Returns:
+            tuple: (path, temporary) where temporary files must be removed after playing
+        """
+        key = None
+        if self.audio_cache is not None:
+            key = AudioCache.key(text, self.voice_id, self.rate, self.volume)
+            path = self.audio_cache.get(key)
+            if path is not None:
+                return path, False
+        fd, tmp_path = tempfile.mkstemp(suffix='.wav', prefix='tts-')
+        os.close(fd)
+        started = time.time()
+        self._rendering = True
         try:
-            logger.info(f"TTS thread acquired lock, speaking: '{text[:30]}...'")
-            self.engine.say(text)
+            self.engine.save_to_file(text, tmp_path)
             self.engine.runAndWait()
-            logger.info("TTS thread finished speaking and runAndWait.")
-        except RuntimeError as e:
-            logger.error(f"TTS thread RuntimeError (likely loop issue): {e}")
-        except Exception as e:
-            logger.error(f"Error in TTS thread: {e}")
         finally:
-            # Ensure the lock is always released
-            self.engine_lock.release()
-            logger.info("TTS thread released lock.")
-    
+            self._rendering = False
+        synth_seconds = time.time() - started
+        self.latency.record('synthesis', synth_seconds)
+        if key is None:
+            return tmp_path, True
+        return self.audio_cache.put(key, tmp_path, synth_seconds), False
+
+    def _mark_first_audio(self, message):
+        if message['first_audio_at'] is None:
+            message['first_audio_at'] = time.time()
+            self.latency.record('time_to_first_audio', message['first_audio_at'] - message['enqueued_at'])
+
+    def _on_started_utterance(self, name):
+        message = self._current
+        if message is not None and not self._rendering:
+            self._mark_first_audio(message)
+
+    def _on_started_word(self, name, location, length):
+        # Called on the worker thread, so stopping the engine here is safe
+        message = self._current
+        if message is not None and message['status'] != 'speaking':
+            self.engine.stop()
+
+    def _apply_pending_properties(self):
+        with self._lock:
+            pending, self._pending_properties = self._pending_properties, {}
+        for name, value in pending.items():
+            self.engine.setProperty(name, value)
+
+    def _set_property(self, name, value):
+        # Applied by the worker before the next utterance
+        with self._lock:
+            self._pending_properties[name] = value
+
+    def get_stats(self):
+        """Queue depth, message counters and latency percentiles (time to first audio, queue wait, speech)."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['speaking'] = self._current is not None
+            stats['listeners'] = len(self._keys)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['latency'] = self.latency.summary()
+        stats['audio_cache'] = self.audio_cache.stats() if self.audio_cache is not None else None
+        stats['pipeline'] = self.pipeline
+        stats['last_utterance'] = self.last_utterance
+        return stats
+
     def get_available_voices(self):
         """
         Get a list of available voices with names and IDs.
@@ -122,81 +389,64 @@ class TextToSpeech:
         Returns:
             list: List of dictionaries [{"name": name, "id": id}]
         """
-        if not self.engine:
-            return []
-        voices = self.engine.getProperty('voices')
-        return [{"name": v.name, "id": v.id} for v in voices]
-    
+        return list(self.voices)
+
     def set_voice(self, voice_id):
         """
         Set the voice to use
-        
+
         Args:
             voice_id (str): Voice ID to use
-            
+
         Returns:
             bool: Success status
         """
         if not self.engine:
             return False
-            
-        try:
-            self.engine.setProperty('voice', voice_id)
-            self.voice_id = voice_id
-            return True
-        except Exception as e:
-            logger.error(f"Error setting voice: {e}")
+
+        if self.voices and voice_id not in {v['id'] for v in self.voices}:
+            logger.error(f"Error setting voice: unknown voice ID {voice_id}")
             return False
+        self._set_property('voice', voice_id)
+        self.voice_id = voice_id
+        return True
 
     def set_voice_by_name(self, name_substring):
         """Set the voice by searching for a substring in the voice name."""
         if not self.engine:
             return False
         found_voice = None
-        for voice in self.engine.getProperty('voices'):
-            if name_substring.lower() in voice.name.lower():
+        for voice in self.voices:
+            if name_substring.lower() in voice['name'].lower():
                 found_voice = voice
                 break
 
         if found_voice:
-            try:
-                self.engine.setProperty('voice', found_voice.id)
-                self.voice_id = found_voice.id
-                logger.info(f"TTS voice set to: {found_voice.name} (ID: {found_voice.id})")
-                return True
-            except Exception as e:
-                logger.error(f"Error setting voice to {found_voice.name}: {e}")
-                return False
+            self._set_property('voice', found_voice['id'])
+            self.voice_id = found_voice['id']
+            logger.info(f"TTS voice set to: {found_voice['name']} (ID: {found_voice['id']})")
+            return True
         else:
             logger.warning(f"No matching voice found for: {name_substring}")
-            voices = self.engine.getProperty('voices')
-            available_names = [v.name for v in voices]
+            available_names = [v['name'] for v in self.voices]
             logger.info(f"Available voices: {available_names}")
             return False
-    
+
     def set_rate(self, rate):
         """Set speech rate"""
         if not self.engine:
             return False
-            
-        try:
-            self.engine.setProperty('rate', rate)
-            self.rate = rate
-            logger.info(f"TTS rate property set to {rate}") # Add log for confirmation
-            return True
-        except Exception as e:
-            logger.error(f"Error setting rate: {e}")
-            return False
-    
+
+        self._set_property('rate', rate)
+        self.rate = rate
+        logger.info(f"TTS rate property set to {rate}") # Add log for confirmation
+        return True
+
     def set_volume(self, volume):
         """Set speech volume"""
         if not self.engine:
             return False
-            
-        try:
-            self.engine.setProperty('volume', volume)
-            self.volume = volume
-            return True
-        except Exception as e:
-            logger.error(f"Error setting volume: {e}")
-            return False
\ No newline at end of file
+
+        self._set_property('volume', volume)
+        self.volume = volume
+        return True
@@ -0,0 +1,81 @@
+import os
+import hashlib
+import threading
+import logging
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailCache:
+    """
+    Small JPEG thumbnails of snapshots and generated references, made once.
+
+    Thumbnails are named by a hash of the source path, so they can be
+    generated ahead of time when an image is saved and served later as
+    immutable files.
+    """
+
+    def __init__(self, directory='drawing_history/thumbnails', max_size=160, quality=70):
+        """
+        Initialize the cache
+
+        Args:
+            directory (str): Directory the thumbnails are written to
+            max_size (int): Longest side of a thumbnail in pixels
+            quality (int): JPEG quality of the thumbnails
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.quality = quality
+        self.counters = {'generated': 0, 'existing': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def name_for(self, image_path):
+        """File name of the thumbnail for an image path (whether or not it exists yet)."""
+        return hashlib.sha1(os.path.normpath(image_path).encode('utf-8')).hexdigest()[:20] + '.jpg'
+
+    def ensure(self, image_path, frame=None):
+        """
+        Create the thumbnail for an image if it does not exist yet
+
+        Args:
+            image_path (str): Source image file
+            frame (numpy.ndarray, optional): The already decoded image, to skip reading it from disk
+
+        Returns:
+            str | None: Thumbnail file name, or None if the image could not be read
+        """
+        name = self.name_for(image_path)
+        target = os.path.join(self.directory, name)
+        if os.path.exists(target):
+            self._count('existing')
+            return name
+        if frame is None:
+            frame = cv2.imread(image_path)
+        if frame is None:
+            logger.warning(f"Could not read {image_path} for a thumbnail")
+            self._count('failed')
+            return None
+        height, width = frame.shape[:2]
+        scale = min(1.0, self.max_size / float(max(height, width)))
+        thumbnail = cv2.resize(frame, (max(1, int(width * scale)), max(1, int(height * scale))),
+                               interpolation=cv2.INTER_AREA)
+        # Write to a temporary name first so a concurrent reader never sees a partial file
+        tmp_path = os.path.join(self.directory, f"tmp-{threading.get_ident()}-{name}")
+        if not cv2.imwrite(tmp_path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, self.quality]):
+            self._count('failed')
+            return None
+        os.replace(tmp_path, target)
+        self._count('generated')
+        return name
+
+    def _count(self, key):
+        with self._lock:
+            self.counters[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
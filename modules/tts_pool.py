@@ -0,0 +1,119 @@
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class TextToSpeechPool:
+    """
+    Several text-to-speech engines behind the TextToSpeech interface.
+
+    A single engine renders one message at a time, so in browser delivery
+    mode one client's long critique delays every other client's audio. The
+    pool spreads listeners over its engines: each key is bound to the engine
+    with the fewest bound keys when it is first seen, and stays on it so its
+    messages keep their order and superseding still works. Messages without
+    a key (the server's speakers) go to the first engine. forget() drops a
+    binding when its listener goes away.
+    """
+
+    def __init__(self, factory, size=2):
+        """
+        Start the engines, in parallel
+
+        Args:
+            factory (callable): Creates one engine (TextToSpeech or IsolatedTextToSpeech)
+            size (int): Number of engines
+        """
+        with ThreadPoolExecutor(max_workers=size) as executor:
+            self.engines = list(executor.map(lambda _: factory(), range(size)))
+        self._bindings = {}  # key -> engine index
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        """Truthy while any engine works (mirrors TextToSpeech.engine)."""
+        return any(engine.engine for engine in self.engines)
+
+    @property
+    def enabled(self):
+        return any(engine.enabled for engine in self.engines)
+
+    @enabled.setter
+    def enabled(self, enabled):
+        for engine in self.engines:
+            engine.enabled = enabled
+
+    def _engine_for(self, key):
+        if key is None:
+            return self.engines[0]
+        with self._lock:
+            index = self._bindings.get(key)
+            if index is None or not self.engines[index].engine:
+                # Bind to the working engine with the fewest listeners
+                load = [0] * len(self.engines)
+                for bound in self._bindings.values():
+                    load[bound] += 1
+                working = [i for i, engine in enumerate(self.engines) if engine.engine] or [0]
+                index = min(working, key=lambda i: load[i])
+                self._bindings[key] = index
+            return self.engines[index]
+
+    def speak(self, text, key=None, **kwargs):
+        """Queue text on the engine bound to `key`; accepts the same options as TextToSpeech.speak."""
+        return self._engine_for(key).speak(text, key=key, **kwargs)
+
+    def stop_speech(self, reason='cancelled', key=None):
+        """Cancel speech for one listener `key`, or on every engine."""
+        if key is not None:
+            with self._lock:
+                index = self._bindings.get(key)
+            if index is not None:
+                self.engines[index].stop_speech(reason=reason, key=key)
+            return
+        for engine in self.engines:
+            engine.stop_speech(reason=reason)
+
+    def forget(self, key):
+        """Cancel everything for a listener that has gone away and release its engine binding."""
+        with self._lock:
+            index = self._bindings.pop(key, None)
+        if index is not None:
+            self.engines[index].forget(key)
+
+    def close(self, timeout=2):
+        """Shut down every engine."""
+        for engine in self.engines:
+            engine.close(timeout)
+
+    def get_stats(self):
+        """Stats of each engine and the number of bound listeners."""
+        with self._lock:
+            listeners = len(self._bindings)
+        return {'listeners': listeners, 'engines': [engine.get_stats() for engine in self.engines]}
+
+    def get_available_voices(self):
+        """
+        Get a list of available voices with names and IDs (the engines share them).
+
+        Returns:
+            list: List of dictionaries [{"name": name, "id": id}]
+        """
+        return self.engines[0].get_available_voices()
+
+    def set_voice(self, voice_id):
+        """Set the voice on every engine"""
+        return all([engine.set_voice(voice_id) for engine in self.engines])
+
+    def set_voice_by_name(self, name_substring):
+        """Set the voice on every engine by searching for a substring in the voice name."""
+        return all([engine.set_voice_by_name(name_substring) for engine in self.engines])
+
+    def set_rate(self, rate):
+        """Set speech rate on every engine"""
+        return all([engine.set_rate(rate) for engine in self.engines])
+
+    def set_volume(self, volume):
+        """Set speech volume on every engine"""
+        return all([engine.set_volume(volume) for engine in self.engines])
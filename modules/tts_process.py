@@ -0,0 +1,347 @@
+import os
+import sys
+import json
+import time
+import secrets
+import itertools
+import subprocess
+import threading
+import logging
+from collections import OrderedDict, deque
+from multiprocessing.connection import Listener, Client
+
+logger = logging.getLogger(__name__)
+
+
+def _child_main(conn, settings):
+    """Entry point of the TTS child process: owns a TextToSpeech and serves commands from the connection."""
+    # Imported here so the web process never loads the pyttsx3 drivers
+    from modules.text_to_speech import TextToSpeech
+    from modules.audio_cache import AudioCache
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - tts-process - %(name)s - %(levelname)s - %(message)s')
+    audio_cache = None
+    if settings.get('audio_cache_dir'):
+        audio_cache = AudioCache(directory=settings['audio_cache_dir'], max_bytes=settings['audio_cache_bytes'])
+    tts = TextToSpeech(voice_id=settings['voice_id'], rate=settings['rate'], volume=settings['volume'],
+                       audio_cache=audio_cache, pipeline=settings.get('pipeline'))
+    send_lock = threading.Lock()
+
+    def send(*event):
+        with send_lock:
+            conn.send(event)
+
+    def speak_and_report(message_id, text, kwargs):
+        send('done', message_id, tts.speak(text, async_mode=False, **kwargs))
+
+    send('ready', tts.engine is not None, tts.get_available_voices())
+    while True:
+        try:
+            command = conn.recv()
+        except (EOFError, OSError):
+            break
+        name = command[0]
+        if name == 'speak':
+            _, message_id, text, kwargs, deliver, wait = command
+            if deliver:
+                kwargs['deliver'] = lambda path, temporary, index, final, m=message_id: send(
+                    'chunk', m, path, temporary, index, final)
+            if wait:
+                threading.Thread(target=speak_and_report, args=(message_id, text, kwargs), daemon=True).start()
+            else:
+                tts.speak(text, **kwargs)
+        elif name == 'stop':
+            tts.stop_speech(**command[1])
+        elif name == 'forget':
+            tts.forget(command[1])
+        elif name == 'set':
+            getattr(tts, f"set_{command[1]}")(command[2])
+        elif name == 'stats':
+            send('stats', command[1], tts.get_stats())
+        elif name == 'close':
+            break
+    tts.close()
+
+
+class IsolatedTextToSpeech:
+    """
+    Runs the text-to-speech engine in a supervised child process.
+
+    Exposes the same methods as TextToSpeech, but the pyttsx3 driver loop runs
+    in its own process (`python -m modules.tts_process`, so the app module is
+    not re-imported), where it never competes with request handling for the
+    GIL and its crashes cannot take the server down. Commands go over an
+    authenticated local connection without waiting for a reply; a reader
+    thread handles events from the child (rendered chunks for browser
+    delivery, completion and stats). If the child
+    dies it is restarted with backoff and the current voice settings are
+    reapplied, up to `max_restarts` times within `restart_window` seconds.
+    """
+
+    def __init__(self, voice_id=None, rate=150, volume=0.8, audio_cache_dir=None, audio_cache_bytes=100 * 1024 * 1024,
+                 pipeline=None, max_restarts=5, restart_window=300, start_timeout=20, speak_timeout=120):
+        """
+        Start the TTS child process
+
+        Args:
+            voice_id (str, optional): Voice ID to use
+            rate (int): Speech rate (words per minute)
+            volume (float): Volume level (0.0 to 1.0)
+            audio_cache_dir (str, optional): Directory of the synthesized-audio cache, None to disable it
+            audio_cache_bytes (int): Size bound of the audio cache
+            pipeline (bool, optional): Sentence pipelining, passed to the child's TextToSpeech
+            max_restarts (int): Crashes tolerated within restart_window before giving up
+            restart_window (float): Seconds over which crashes are counted
+            start_timeout (float): Seconds to wait for the child to report ready
+            speak_timeout (float): Seconds a synchronous speak() waits for the child to finish speaking
+        """
+        self.voice_id = voice_id
+        self.rate = rate
+        self.volume = volume
+        self.enabled = os.getenv('TTS_ENABLED', 'true').lower() == 'true'
+        self.voices = []  # Cached from the child's ready event
+        self.settings = {
+            'audio_cache_dir': audio_cache_dir,
+            'audio_cache_bytes': audio_cache_bytes,
+            'pipeline': pipeline,
+        }
+        self.max_restarts = max_restarts
+        self.restart_window = restart_window
+        self.start_timeout = start_timeout
+        self.speak_timeout = speak_timeout
+        self.counters = {'starts': 0, 'crashes': 0, 'send_failures': 0}
+        self._ids = itertools.count(1)
+        self._deliveries = OrderedDict()  # message id -> deliver callback
+        self._waiters = {}  # message id or stats request id -> [Event, result]
+        self._crashes_at = deque()
+        self._process = None
+        self._conn = None
+        self._engine_ok = False
+        self._closing = False
+        self._ready = threading.Event()
+        self._send_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._start()
+        if not self._ready.wait(start_timeout) or not self._engine_ok:
+            logger.error("TTS process did not start a working engine")
+            self.enabled = False
+
+    @property
+    def engine(self):
+        """Truthy while the child process has a working engine (mirrors TextToSpeech.engine)."""
+        return self._engine_ok and self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        """Start the child and connect to it; returns False if it did not connect."""
+        authkey = secrets.token_bytes(16)
+        listener = Listener(('127.0.0.1', 0), authkey=authkey)
+        settings = dict(self.settings, voice_id=self.voice_id, rate=self.rate, volume=self.volume)
+        project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'modules.tts_process', str(listener.address[1]), json.dumps(settings)],
+            cwd=project_dir,
+            env=dict(os.environ, DRAWR_TTS_AUTHKEY=authkey.hex())
+        )
+        self._ready.clear()
+        self._process = process
+        self.counters['starts'] += 1
+        logger.info(f"TTS process started with PID {process.pid}")
+
+        # Listener.accept has no timeout; closing the listener unblocks it if the child never connects
+        accepted = []
+        accept_thread = threading.Thread(target=lambda: accepted.append(listener.accept()), daemon=True)
+        accept_thread.start()
+        accept_thread.join(self.start_timeout)
+        listener.close()
+        if not accepted:
+            logger.error("TTS process did not connect")
+            process.kill()
+            process.wait()
+            self._conn = None
+            self._engine_ok = False
+            return False
+        self._conn = accepted[0]
+        threading.Thread(target=self._read_events, args=(self._conn, process), name="tts-process-reader",
+                         daemon=True).start()
+        return True
+
+    def _read_events(self, conn, process):
+        while True:
+            try:
+                event = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._handle_event(event)
+        try:
+            process.wait(1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        if not self._closing:
+            self._on_crash(process)
+
+    def _handle_event(self, event):
+        name = event[0]
+        if name == 'ready':
+            self._engine_ok, self.voices = event[1], event[2]
+            self._ready.set()
+        elif name == 'chunk':
+            _, message_id, path, temporary, index, final = event
+            with self._lock:
+                deliver = self._deliveries.pop(message_id, None) if final else self._deliveries.get(message_id)
+            if deliver is None:
+                if temporary and os.path.exists(path):
+                    os.remove(path)
+                return
+            try:
+                deliver(path, temporary, index, final)
+            except Exception as e:
+                logger.error(f"Error delivering speech chunk: {e}")
+        elif name in ('done', 'stats'):
+            with self._lock:
+                waiter = self._waiters.pop(event[1], None)
+            if waiter is not None:
+                waiter[1] = event[2]
+                waiter[0].set()
+
+    def _on_crash(self, process):
+        logger.error(f"TTS process {process.pid} exited unexpectedly (exit code {process.returncode})")
+        self._engine_ok = False
+        with self._lock:
+            waiters, self._waiters = self._waiters, {}
+            self._deliveries.clear()
+        for event, _ in waiters.values():
+            event.set()
+        # A restarted child that never connects counts as another crash, with the same backoff and budget
+        while not self._closing:
+            self.counters['crashes'] += 1
+            now = time.time()
+            self._crashes_at.append(now)
+            while self._crashes_at and now - self._crashes_at[0] > self.restart_window:
+                self._crashes_at.popleft()
+            if len(self._crashes_at) > self.max_restarts:
+                logger.error(f"TTS process crashed {len(self._crashes_at)} times in {self.restart_window}s, "
+                             "not restarting")
+                return
+            time.sleep(min(10, 0.5 * 2 ** (len(self._crashes_at) - 1)))
+            if self._closing or self._start():
+                return
+
+    def _send(self, *command):
+        with self._send_lock:
+            try:
+                self._conn.send(command)
+                return True
+            except (OSError, ValueError, AttributeError) as e:
+                self.counters['send_failures'] += 1
+                logger.error(f"Could not send '{command[0]}' to the TTS process: {e}")
+                return False
+
+    def _request(self, request_id, timeout, *command):
+        waiter = [threading.Event(), None]
+        with self._lock:
+            self._waiters[request_id] = waiter
+        if not self._send(*command) or not waiter[0].wait(timeout):
+            with self._lock:
+                self._waiters.pop(request_id, None)
+            return None
+        return waiter[1]
+
+    def speak(self, text, async_mode=True, deliver=None, **kwargs):
+        """
+        Queue text to be spoken by the child process; accepts the same options as TextToSpeech.speak
+
+        Returns:
+            bool: Whether the message was sent (in sync mode: whether it was spoken)
+        """
+        if not self.enabled or not self.engine:
+            logger.warning("TTS is disabled or not properly initialized")
+            return False
+        message_id = next(self._ids)
+        if deliver is not None:
+            with self._lock:
+                self._deliveries[message_id] = deliver
+                while len(self._deliveries) > 100:
+                    self._deliveries.popitem(last=False)
+        if async_mode:
+            return self._send('speak', message_id, text, kwargs, deliver is not None, False)
+        return bool(self._request(message_id, self.speak_timeout, 'speak', message_id, text, kwargs, deliver is not None, True))
+
+    def stop_speech(self, reason='cancelled', key=None):
+        """Cancel the current utterance and drop everything still queued, for one listener `key` or for all."""
+        if self.engine:
+            self._send('stop', {'reason': reason, 'key': key})
+
+    def forget(self, key):
+        """Cancel everything for a listener that has gone away and drop its state."""
+        if self.engine:
+            self._send('forget', key)
+
+    def close(self, timeout=2):
+        """Stop speaking and shut down the child process."""
+        self._closing = True
+        if self._process is None:
+            return
+        self._send('close')
+        try:
+            self._process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self._process.terminate()
+
+    def get_stats(self, timeout=1):
+        """The child's TTS stats plus process supervision counters."""
+        stats = None
+        if self.engine:
+            request_id = f"stats-{next(self._ids)}"
+            stats = self._request(request_id, timeout, 'stats', request_id)
+        stats = dict(stats or {})
+        stats['process'] = dict(self.counters, pid=self._process.pid if self._process else None,
+                                alive=bool(self._process and self._process.poll() is None))
+        return stats
+
+    def get_available_voices(self):
+        """
+        Get a list of available voices with names and IDs (cached when the child starts).
+
+        Returns:
+            list: List of dictionaries [{"name": name, "id": id}]
+        """
+        return list(self.voices)
+
+    def set_voice(self, voice_id):
+        """Set the voice to use"""
+        if not self.engine:
+            return False
+        if self.voices and voice_id not in {v['id'] for v in self.voices}:
+            logger.error(f"Error setting voice: unknown voice ID {voice_id}")
+            return False
+        self.voice_id = voice_id
+        return self._send('set', 'voice', voice_id)
+
+    def set_voice_by_name(self, name_substring):
+        """Set the voice by searching for a substring in the voice name."""
+        for voice in self.voices:
+            if name_substring.lower() in voice['name'].lower():
+                logger.info(f"TTS voice set to: {voice['name']} (ID: {voice['id']})")
+                return self.set_voice(voice['id'])
+        logger.warning(f"No matching voice found for: {name_substring}")
+        return False
+
+    def set_rate(self, rate):
+        """Set speech rate"""
+        if not self.engine:
+            return False
+        self.rate = rate
+        return self._send('set', 'rate', rate)
+
+    def set_volume(self, volume):
+        """Set speech volume"""
+        if not self.engine:
+            return False
+        self.volume = volume
+        return self._send('set', 'volume', volume)
+
+
+if __name__ == '__main__':
+    # Started by IsolatedTextToSpeech: connect back to the parent and serve its commands
+    connection = Client(('127.0.0.1', int(sys.argv[1])), authkey=bytes.fromhex(os.environ['DRAWR_TTS_AUTHKEY']))
+    _child_main(connection, json.loads(sys.argv[2]))
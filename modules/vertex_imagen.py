@@ -4,39 +4,94 @@ from PIL import Image as PILImage
 import io
 import logging
 import traceback
-import vertexai
-# Import the necessary SDK classes for image generation
-from vertexai.vision_models import ImageGenerationModel, Image
+import threading
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 class VertexImagen:
     def __init__(self):
-        """Initializes the Vertex AI client using the SDK for image generation."""
+        """
+        Prepares the Vertex AI image generation client.
+
+        The Vertex SDK import, vertexai.init and model loading are slow, so they are
+        deferred to a background warm-up (start_warmup) or to the first use. A missing
+        VERTEX_PROJECT_ID disables image generation instead of failing the app.
+        """
         self.project_id = os.getenv("VERTEX_PROJECT_ID")
         self.location = os.getenv("VERTEX_LOCATION", "us-central1")
         # Use the generation model ID from the latest docs
         self.model_id = "imagen-3.0-generate-002"
+        self.model = None
+        self.state = "not_started"  # not_started -> initializing -> ready | failed; or disabled
+        self.error = None
+        self.init_seconds = None
+        self._ready = threading.Event()
+        self._init_lock = threading.Lock()
+        # SDK calls have no timeout of their own; run them here so callers can stop waiting
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="imagen")
         if not self.project_id:
-            raise ValueError("VERTEX_PROJECT_ID environment variable not set.")
+            self.state = "disabled"
+            self.error = "VERTEX_PROJECT_ID environment variable not set."
+            logger.warning(f"Vertex Imagen disabled: {self.error}")
+            self._ready.set()
+
+    def start_warmup(self):
+        """Initialize the SDK and model on a background thread."""
+        if self.state != "not_started":
+            return
+        threading.Thread(target=self._initialize, name="imagen-warmup", daemon=True).start()
 
+    def _initialize(self):
+        with self._init_lock:
+            if self.state != "not_started":
+                return
+            self.state = "initializing"
+        start = time.time()
         try:
+            # Imported here: the SDK import alone takes seconds
+            import vertexai
+            from vertexai.vision_models import ImageGenerationModel
+
             # Initialize vertexai library
             vertexai.init(project=self.project_id, location=self.location)
             logger.info(f"Vertex AI SDK initialized for project {self.project_id} in {self.location}.")
 
             # Load the image generation model using the SDK
             self.model = ImageGenerationModel.from_pretrained(self.model_id)
+            self.state = "ready"
             logger.info(f"Vertex AI ImageGenerationModel ({self.model_id}) initialized.")
-
         except Exception as e:
-            logger.error(f"Fatal: Error initializing Vertex AI SDK or Model: {e}")
+            self.state = "failed"
+            self.error = f"Error initializing Vertex AI SDK or Model: {e}"
+            logger.error(self.error)
             logger.error(traceback.format_exc())
-            raise
+        finally:
+            self.init_seconds = round(time.time() - start, 3)
+            logger.info(f"Vertex Imagen initialization finished in {self.init_seconds}s (state: {self.state})")
+            self._ready.set()
+
+    def ensure_ready(self, timeout=None):
+        """
+        Initialize on first use if needed and wait for the client.
 
-    def generate_image_from_text(self, prompt: str, output_dir: str = "generated_images", filename_prefix: str = "generated") -> str | None:
+        Returns:
+            bool: True if the model is ready to generate images
+        """
+        if self.state == "not_started":
+            self.start_warmup()
+        self._ready.wait(timeout)
+        return self.state == "ready"
+
+    def status(self):
+        """Readiness of the image generation client."""
+        return {"state": self.state, "error": self.error, "init_seconds": self.init_seconds}
+
+    def generate_image_from_text(self, prompt: str, output_dir: str = "generated_images", filename_prefix: str = "generated", deadline=None) -> str | None:
         """
         Generates an image based on a text prompt using the Vertex AI SDK.
 
@@ -44,20 +99,36 @@ class VertexImagen:
             prompt: Text prompt guiding the image generation.
             output_dir: Directory to save the generated image.
             filename_prefix: Prefix for the output filename.
+            deadline: Optional Deadline; the call is abandoned once its budget is spent.
 
         Returns:
-            The file path of the generated image, or None if an error occurred.
+            The file path of the generated image, or None if an error occurred or the deadline passed.
         """
         logger.info(f"Generating image via SDK with prompt: '{prompt[:100]}...'")
+        wait_timeout = deadline.remaining() if deadline is not None else 120
+        if not self.ensure_ready(timeout=wait_timeout):
+            logger.error(f"Vertex Imagen is not available (state: {self.state}): {self.error}")
+            return None
         os.makedirs(output_dir, exist_ok=True)
 
         try:
             logger.debug("Sending request via SDK model.generate_images...")
             # generate_images returns a response object
-            response = self.model.generate_images(
+            future = self._executor.submit(
+                self.model.generate_images,
                 prompt=prompt,
                 number_of_images=1,
             )
+            # Wait in short slices so a cancelled deadline stops the wait promptly
+            while True:
+                try:
+                    response = future.result(timeout=0.25 if deadline is not None else None)
+                    break
+                except FuturesTimeoutError:
+                    if deadline.expired():
+                        logger.error(f"Vertex AI image generation abandoned: deadline expired or cancelled ({deadline.budget:g}s budget).")
+                        future.cancel()
+                        return None
             logger.info("Received response from Vertex AI SDK.")
 
             # Check if the response object exists and has the .images attribute which is not empty
@@ -72,8 +143,9 @@ class VertexImagen:
                     logger.info(f"Successfully accessed image bytes (length: {len(generated_image_bytes)}).")
 
                     # Save the generated image
-                    timestamp = int(time.time()) # Add timestamp for unique filenames
-                    output_filename = f"{filename_prefix}_{timestamp}.png"
+                    # Timestamp plus a random suffix, so images finished in the same second never share a file
+                    timestamp = int(time.time())
+                    output_filename = f"{filename_prefix}_{timestamp}_{uuid.uuid4().hex[:8]}.png"
                     output_path = os.path.join(output_dir, output_filename)
 
                     logger.debug(f"Attempting to save image to: {output_path}")
@@ -109,6 +181,8 @@ if __name__ == '__main__':
     print("Running VertexImagen module test...")
     try:
         imagen_client = VertexImagen()
+        if not imagen_client.ensure_ready():
+            raise ValueError(imagen_client.error)
         test_prompt = "Generate a serene landscape with mountains and a lake."
         result_path = imagen_client.generate_image_from_text(test_prompt)
         if result_path:
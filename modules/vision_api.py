@@ -3,75 +3,245 @@ import base64
 import cv2
 import numpy as np
 import logging  # Add logging
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+from modules.latency import LatencyTracker
+from modules.sketch_metrics import compute_sketch_metrics, format_hints
+from modules.vision_providers import GeminiProvider, ProviderRouter, providers_from_env
 
 logger = logging.getLogger(__name__)  # Add logger
 
 class VisionAPI:
-    def __init__(self, api_key=None, api_url=None, system_prompt=None):
+    def __init__(self, api_key=None, api_url=None, system_prompt=None, hedging=None, hedge_budget=None, providers=None):
         self.api_key = api_key
         self.api_url = api_url  # Use the value passed in, not hardcoded
         self.system_prompt = system_prompt
         print(f"[VisionAPI] Using API URL: {self.api_url}")
 
-    def _call_gemini_api(self, prompt_parts, model_url=None):
-        """Helper function to call the Gemini API."""
-        if not self.api_key:
-            logger.error("API key is not configured.")
-            return {"text": "Error: Vision API key not configured."}
-        if model_url is None:
-            model_url = self.api_url  # Default to the main analysis URL if not specified
-        if not model_url:
-            logger.error("API URL is not configured.")
-            return {"text": "Error: Vision API URL not configured."}
+        # Backends in preference order; the router sends each call to the fastest healthy one.
+        if providers is None:
+            providers = providers_from_env(api_key, api_url)
+        self.router = ProviderRouter(providers)
+        self.max_attempts = int(os.getenv('VISION_MAX_ATTEMPTS', '2'))
+        logger.info(f"Vision providers (preference order): {[p.key for p in providers]}")
+
+        # Hedged requests: opt-in, fire a duplicate request once the first one
+        # is slower than the observed p90 for its call type.
+        if hedging is None:
+            hedging = os.getenv('VISION_HEDGING_ENABLED', 'false').lower() == 'true'
+        if hedge_budget is None:
+            hedge_budget = float(os.getenv('VISION_HEDGE_BUDGET', '0.1'))
+        self.hedging = hedging
+        self.hedge_budget = hedge_budget  # Max extra requests as a fraction of all requests
+        self.hedge_min_samples = int(os.getenv('VISION_HEDGE_MIN_SAMPLES', '20'))
+        self.hedge_stats = {'requests': 0, 'fired': 0, 'won': 0, 'skipped_budget': 0}
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vision-api")
+        self._sessions = threading.local()
+        if self.hedging:
+            logger.info(f"Hedged requests enabled (budget {self.hedge_budget:.0%} extra requests)")
+
+        # Model tiering: a fast tier checks whether the drawing changed materially
+        # before the heavy model is asked for a full critique.
+        self.tiering = os.getenv('VISION_TIERING_ENABLED', 'true').lower() == 'true'
+        self.change_threshold = float(os.getenv('VISION_CHANGE_THRESHOLD', '0.02'))  # Fraction of changed pixels
+        fast_url = os.getenv('VISION_FAST_API_URL')
+        self.fast_router = ProviderRouter([GeminiProvider(api_key, fast_url, timeout=15)]) if api_key and fast_url else None
+        self.tier_latency = LatencyTracker()
+        self.tier_stats = {'fast': 0, 'heavy': 0, 'skipped_unchanged': 0, 'skipped_blank': 0}
+        # Local OpenCV pre-analysis: skip blank pages and attach metrics as prompt hints
+        self.min_ink_coverage = float(os.getenv('VISION_MIN_INK_COVERAGE', '0.002'))
+        self.local_hints = os.getenv('VISION_LOCAL_HINTS', 'true').lower() == 'true'
+        self._last_critique = None  # (thumbnail, jpeg bytes) of the last fully critiqued frame
 
-        payload = {"contents": [{"parts": prompt_parts}]}
-        request_url = f"{model_url}?key={self.api_key}"
-        logger.debug(f"Calling Gemini API: {request_url}")
+    def _session(self):
+        """Per-thread requests session, so keep-alive connections are reused across calls."""
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self._sessions.session = requests.Session()
+        return session
 
+    def _post_request(self, provider, prompt_parts, call_type, router=None, timeout=None, history=None):
+        """Send one request to a provider and record its latency. Raises on transport or parse errors."""
+        url, headers, payload = provider.build_request(prompt_parts, history)
+        logger.debug(f"Calling {provider.label} API ({provider.model})")
+        start = time.time()
+        ok = False
         try:
-            response = requests.post(
-                request_url,
-                headers={"Content-Type": "application/json"},
-                json=payload,
-                timeout=45  # Increased timeout slightly
-            )
+            response = self._session().post(url, headers=headers, json=payload, timeout=timeout or provider.timeout)
             response.raise_for_status()
-            data = response.json()
-            candidates = data.get("candidates")
-            if not candidates:
-                logger.warning(f"No candidates found in response: {data}")
-                return {"text": "No response content received from AI."}
-            parts = candidates[0].get("content", {}).get("parts")
-            if not parts:
-                logger.warning(f"No parts found in candidate content: {candidates[0]}")
-                return {"text": "No response text received from AI."}
-            text = parts[0].get("text", "")
-            if not text:
-                logger.warning(f"Empty text in response part: {parts[0]}")
-                text = "No feedback received from the AI."
-            return {"text": text.strip()}
-        except requests.exceptions.RequestException as e:
-            error_text = f"Error communicating with Gemini API: {e}"
-            if hasattr(e, 'response') and e.response is not None:
-                error_text += f" | Status: {e.response.status_code} | Response: {e.response.text[:500]}"  # Limit response text length
-            logger.error(error_text)
-            return {"text": error_text}
-        except Exception as e:
-            logger.error(f"Unexpected error during Gemini API call: {e}", exc_info=True)
-            return {"text": f"Unexpected error communicating with Gemini API: {e}"}
-
-    def analyze_drawing(self, frame):
-        """Analyzes drawing for critique using the configured system prompt."""
+            text = provider.parse_response(response.json())
+            ok = True
+            return text
+        finally:
+            (router or self.router).record(provider, call_type, time.time() - start, ok)
+
+    def _hedge_allowed(self):
+        """Check the hedging budget and account for a hedge if one may be fired."""
+        with self._stats_lock:
+            if self.hedge_stats['fired'] < self.hedge_budget * self.hedge_stats['requests']:
+                self.hedge_stats['fired'] += 1
+                return True
+            self.hedge_stats['skipped_budget'] += 1
+            return False
+
+    def _post_hedged(self, provider, prompt_parts, call_type, timeout=None, history=None):
+        """
+        Send a request, hedging it with an identical second request if the first
+        exceeds the p90 latency observed for this provider and call type.
+
+        Whichever request answers first wins. The loser is cancelled if it has not
+        started yet; otherwise its response is discarded when it arrives.
+        """
+        with self._stats_lock:
+            self.hedge_stats['requests'] += 1
+        threshold = self.router.tracker.percentile(
+            self.router.stats_key(provider, call_type), 90, min_samples=self.hedge_min_samples
+        )
+        primary = self._executor.submit(self._post_request, provider, prompt_parts, call_type, None, timeout, history)
+        if threshold is None:
+            return primary.result()
+
+        try:
+            return primary.result(timeout=threshold)
+        except FuturesTimeoutError:
+            pass
+
+        if not self._hedge_allowed():
+            return primary.result()
+
+        logger.info(f"Hedging '{call_type}' request to {provider.key} after {threshold:.2f}s (p90)")
+        # The hedge only gets what is left of the primary's timeout
+        hedge_timeout = max(0.1, (timeout or provider.timeout) - threshold)
+        hedge = self._executor.submit(self._post_request, provider, prompt_parts, call_type, None, hedge_timeout,
+                                      history)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    first_error = first_error or future.exception()
+                    continue
+                for loser in pending:
+                    loser.cancel()
+                if future is hedge:
+                    with self._stats_lock:
+                        self.hedge_stats['won'] += 1
+                    logger.info(f"Hedged '{call_type}' request won")
+                return future.result()
+        raise first_error
+
+    def get_stats(self):
+        """Return per-provider health and latency, and hedging counters."""
+        with self._stats_lock:
+            hedging = dict(self.hedge_stats)
+        hedging['enabled'] = self.hedging
+        hedging['fire_rate'] = round(hedging['fired'] / hedging['requests'], 3) if hedging['requests'] else 0.0
+        hedging['win_rate'] = round(hedging['won'] / hedging['fired'], 3) if hedging['fired'] else 0.0
+        tiers = {}
+        latency = self.tier_latency.summary()
+        with self._stats_lock:
+            for tier in ('fast', 'heavy'):
+                tiers[tier] = {'calls': self.tier_stats[tier], 'latency': latency.get(tier)}
+            tiers['skipped_unchanged'] = self.tier_stats['skipped_unchanged']
+            tiers['skipped_blank'] = self.tier_stats['skipped_blank']
+            requests_total = self.tier_stats['heavy'] + tiers['skipped_unchanged'] + tiers['skipped_blank']
+        tiers['remote_share'] = round(tiers['heavy']['calls'] / requests_total, 3) if requests_total else None
+        tiers['enabled'] = self.tiering
+        tiers['fast_model'] = self.fast_router.providers[0].key if self.fast_router else None
+        return {'providers': self.router.summary(), 'explorations': self.router.explorations,
+                'hedging': hedging, 'tiers': tiers}
+
+    def _call_vision_api(self, prompt_parts, call_type="critique", router=None, deadline=None, history=None):
+        """
+        Helper function to call the best available vision provider, failing over on errors.
+
+        If a Deadline is given, each attempt's timeout is capped at the remaining budget
+        and no attempt is started once it is spent; the result then carries "timed_out".
+        Earlier conversation turns can be passed as history (see VisionProvider).
+        """
+        router = router or self.router
+        candidates = router.candidates(call_type)
+        if not candidates:
+            logger.error("No vision provider is configured.")
+            return {"text": "Error: Vision API key not configured."}
+
+        error_text = None
+        for provider in candidates[:self.max_attempts]:
+            timeout = provider.timeout
+            if deadline is not None:
+                if deadline.expired():
+                    logger.warning(f"Deadline exceeded, not calling {provider.label} API for '{call_type}'")
+                    return {"text": error_text or f"Error: deadline exceeded before the {call_type} call.", "timed_out": True}
+                timeout = deadline.timeout(provider.timeout)
+            try:
+                if self.hedging and router is self.router:
+                    text = self._post_hedged(provider, prompt_parts, call_type, timeout, history)
+                else:
+                    text = self._post_request(provider, prompt_parts, call_type, router, timeout, history)
+                return {"text": text, "provider": provider.key}
+            except requests.exceptions.RequestException as e:
+                error_text = f"Error communicating with {provider.label} API: {e}"
+                if hasattr(e, 'response') and e.response is not None:
+                    error_text += f" | Status: {e.response.status_code} | Response: {e.response.text[:500]}"  # Limit response text length
+                logger.error(error_text)
+            except Exception as e:
+                logger.error(f"Unexpected error during {provider.label} API call: {e}", exc_info=True)
+                error_text = f"Unexpected error communicating with {provider.label} API: {e}"
+        if deadline is not None and deadline.expired():
+            return {"text": error_text, "timed_out": True}
+        return {"text": error_text}
+
+    def analyze_drawing(self, frame, force_full=False, deadline=None, context=None):
+        """
+        Analyzes drawing for critique using the configured system prompt.
+
+        The fast tier runs first. The heavy model is skipped when the page looks
+        blank or, with tiering enabled, when the drawing has not changed materially
+        since the last full critique, unless force_full is set. Local metrics are
+        attached to the prompt as hints. With a SessionContext, earlier critiques of
+        the session are sent as conversation turns before the current drawing.
+        """
+        quick = self.quick_analysis(frame, check_change=self.tiering and not force_full, deadline=deadline)
+        if not force_full and not quick["needs_assistance"]:
+            reason = "blank" if quick["blank"] else "unchanged"
+            logger.info(f"Fast tier skipped full critique ({reason}, change {quick['change_ratio']:.3f})")
+            with self._stats_lock:
+                self.tier_stats[f'skipped_{reason}'] += 1
+            if reason == "blank":
+                text = "The page looks blank. Start sketching and ask again, or ask for a full critique."
+            else:
+                text = "No significant changes since the last critique. Keep drawing, or ask for a full critique."
+            return {"text": text, "tier": "fast", "skipped": True, "reason": reason, "metrics": quick["metrics"]}
+
         logger.info("Requesting drawing analysis/critique...")
         _, buffer = cv2.imencode('.jpg', frame)
         img_b64 = base64.b64encode(buffer).decode('utf-8')
+        prompt_text = context.prompt(self.system_prompt) if context is not None else self.system_prompt
+        history = context.history() if context is not None else None
+        if self.local_hints:
+            prompt_text = f"{prompt_text}\n\n{format_hints(quick['metrics'])}"
         prompt_parts = [
-            {"text": self.system_prompt},
+            {"text": prompt_text},
             {"inline_data": {"mime_type": "image/jpeg", "data": img_b64}}
         ]
-        return self._call_gemini_api(prompt_parts)
+        start = time.time()
+        result = self._call_vision_api(prompt_parts, call_type="critique", deadline=deadline, history=history)
+        self.tier_latency.record('heavy', time.time() - start, ok='provider' in result)
+        with self._stats_lock:
+            self.tier_stats['heavy'] += 1
+        if 'provider' in result:
+            self._last_critique = (self._thumbnail(frame), buffer.tobytes())
+        result["tier"] = "heavy"
+        result["metrics"] = quick["metrics"]
+        return result
 
-    def get_image_description(self, frame):
+    def get_image_description(self, frame, deadline=None):
         """Gets a detailed textual description of the image."""
         logger.info("Requesting image description...")
         _, buffer = cv2.imencode('.jpg', frame)
@@ -85,9 +255,9 @@ class VisionAPI:
             {"text": description_prompt},
             {"inline_data": {"mime_type": "image/jpeg", "data": img_b64}}
         ]
-        return self._call_gemini_api(prompt_parts)
+        return self._call_vision_api(prompt_parts, call_type="description", deadline=deadline)
 
-    def refine_generation_prompt(self, description, critique):
+    def refine_generation_prompt(self, description, critique, deadline=None):
         """Creates a text-to-image prompt based on description and critique."""
         logger.info("Refining text-to-image generation prompt...")
         refinement_system_prompt = (
@@ -105,12 +275,79 @@ class VisionAPI:
             "GENERATED IMAGE PROMPT:"
         )
         prompt_parts = [{"text": refinement_system_prompt}]
-        result = self._call_gemini_api(prompt_parts)
+        result = self._call_vision_api(prompt_parts, call_type="refine", deadline=deadline)
         if "GENERATED IMAGE PROMPT:" in result.get("text", ""):
             result["text"] = result["text"].split("GENERATED IMAGE PROMPT:")[-1].strip()
         return result
 
-    def quick_analysis(self, frame):
-        # Optionally implement a lightweight check or just return no suggestion
-        return {"needs_assistance": False}
+    def _thumbnail(self, frame):
+        """Small blurred grayscale copy used for cheap change detection."""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, (160, 120), interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def _ask_fast_model(self, frame, previous_jpeg, deadline=None):
+        """Ask the fast model whether the drawing changed. Returns True/False, or None if it could not tell."""
+        _, buffer = cv2.imencode('.jpg', frame)
+        prompt_parts = [
+            {"text": "The first image is a drawing as it was at the last critique, the second is the same drawing now. "
+                     "Has the drawing changed materially (new or corrected strokes, shapes or shading, not lighting or "
+                     "camera noise)? Answer with exactly one word: CHANGED or UNCHANGED."},
+            {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(previous_jpeg).decode('utf-8')}},
+            {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(buffer).decode('utf-8')}}
+        ]
+        result = self._call_vision_api(prompt_parts, call_type="change_check", router=self.fast_router, deadline=deadline)
+        if 'provider' not in result:
+            return None
+        answer = result["text"].strip().upper()
+        if answer.startswith("UNCHANGED"):
+            return False
+        if answer.startswith("CHANGED"):
+            return True
+        return None
+
+    def quick_analysis(self, frame, check_change=True, deadline=None):
+        """
+        Fast tier: local OpenCV metrics plus a check for material change since the last full critique.
+
+        A local pixel comparison settles clear cases; the fast model (VISION_FAST_API_URL)
+        is only asked when the change is close to the threshold.
+
+        Args:
+            frame (numpy.ndarray): Camera frame
+            check_change (bool): Whether to compare against the last critiqued frame
+            deadline (Deadline, optional): Time budget for the fast model call
+
+        Returns:
+            dict: {"needs_assistance", "changed", "blank", "change_ratio", "metrics", "tier"}
+        """
+        start = time.time()
+        tier = "local"
+        metrics = compute_sketch_metrics(frame)
+        blank = metrics['ink_coverage'] < self.min_ink_coverage
+        if not check_change or self._last_critique is None:
+            change_ratio = 1.0
+            changed = True
+        else:
+            previous_thumb, previous_jpeg = self._last_critique
+            diff = cv2.absdiff(self._thumbnail(frame), previous_thumb)
+            change_ratio = float(np.count_nonzero(diff > 40)) / diff.size
+            changed = change_ratio >= self.change_threshold
+            inconclusive = self.change_threshold / 4 <= change_ratio < self.change_threshold * 4
+            if self.fast_router is not None and inconclusive:
+                answer = self._ask_fast_model(frame, previous_jpeg, deadline)
+                if answer is not None:
+                    changed = answer
+                    tier = "fast_model"
+        self.tier_latency.record('fast', time.time() - start)
+        with self._stats_lock:
+            self.tier_stats['fast'] += 1
+        return {
+            "needs_assistance": changed and not blank,
+            "changed": changed,
+            "blank": blank,
+            "change_ratio": change_ratio,
+            "metrics": metrics,
+            "tier": tier,
+        }
 
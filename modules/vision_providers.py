@@ -0,0 +1,280 @@
+import os
+import time
+import random
+import threading
+import logging
+
+from modules.latency import LatencyTracker
+
+logger = logging.getLogger(__name__)
+
+
+class VisionProvider:
+    """
+    Base class for a vision-capable LLM backend.
+
+    Prompts are passed around in Gemini's ``parts`` format ({"text": ...} and
+    {"inline_data": {...}} dicts); each provider translates them into its own
+    request body and parses the reply back into plain text. Earlier turns of a
+    conversation can be passed as ``history``, a list of {"role": "user" or
+    "model", "parts": [...]} dicts, oldest first.
+    """
+
+    name = "provider"
+    label = "Vision"
+
+    def __init__(self, api_key, model, timeout=45):
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+
+    @property
+    def key(self):
+        """Identifier used for routing statistics, e.g. 'gemini:gemini-1.5-pro-002'."""
+        return f"{self.name}:{self.model}"
+
+    def build_request(self, prompt_parts, history=None):
+        """Return (url, headers, payload) for a request carrying the given prompt parts after the history turns."""
+        raise NotImplementedError
+
+    def parse_response(self, data):
+        """Extract the reply text from a decoded JSON response."""
+        raise NotImplementedError
+
+
+class GeminiProvider(VisionProvider):
+    name = "gemini"
+    label = "Gemini"
+
+    def __init__(self, api_key, api_url, timeout=45):
+        # The model name is the last path segment, e.g. .../models/gemini-1.5-pro-002:generateContent
+        model = api_url.rstrip('/').split('/')[-1].split(':')[0] if api_url else "unknown"
+        super().__init__(api_key, model, timeout)
+        self.api_url = api_url
+
+    def build_request(self, prompt_parts, history=None):
+        url = f"{self.api_url}?key={self.api_key}"
+        contents = [{"role": turn["role"], "parts": turn["parts"]} for turn in history or []]
+        payload = {"contents": contents + [{"role": "user", "parts": prompt_parts}]}
+        return url, {"Content-Type": "application/json"}, payload
+
+    def parse_response(self, data):
+        candidates = data.get("candidates")
+        if not candidates:
+            logger.warning(f"No candidates found in response: {data}")
+            return "No response content received from AI."
+        parts = candidates[0].get("content", {}).get("parts")
+        if not parts:
+            logger.warning(f"No parts found in candidate content: {candidates[0]}")
+            return "No response text received from AI."
+        text = parts[0].get("text", "")
+        if not text:
+            logger.warning(f"Empty text in response part: {parts[0]}")
+            text = "No feedback received from the AI."
+        return text.strip()
+
+
+class OpenAIProvider(VisionProvider):
+    name = "openai"
+    label = "OpenAI"
+    api_url = "https://api.openai.com/v1/chat/completions"
+
+    def _content(self, parts):
+        content = []
+        for part in parts:
+            if "text" in part:
+                content.append({"type": "text", "text": part["text"]})
+            elif "inline_data" in part:
+                data = part["inline_data"]
+                content.append({
+                    "type": "image_url",
+                    "image_url": {"url": f"data:{data['mime_type']};base64,{data['data']}"}
+                })
+        return content
+
+    def build_request(self, prompt_parts, history=None):
+        messages = [{"role": "assistant" if turn["role"] == "model" else "user", "content": self._content(turn["parts"])}
+                    for turn in history or []]
+        messages.append({"role": "user", "content": self._content(prompt_parts)})
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"}
+        payload = {"model": self.model, "messages": messages}
+        return self.api_url, headers, payload
+
+    def parse_response(self, data):
+        choices = data.get("choices")
+        if not choices:
+            logger.warning(f"No choices found in response: {data}")
+            return "No response content received from AI."
+        text = choices[0].get("message", {}).get("content") or ""
+        if not text:
+            text = "No feedback received from the AI."
+        return text.strip()
+
+
+class AnthropicProvider(VisionProvider):
+    name = "anthropic"
+    label = "Anthropic"
+    api_url = "https://api.anthropic.com/v1/messages"
+
+    def _content(self, parts):
+        content = []
+        for part in parts:
+            if "text" in part:
+                content.append({"type": "text", "text": part["text"]})
+            elif "inline_data" in part:
+                data = part["inline_data"]
+                content.append({
+                    "type": "image",
+                    "source": {"type": "base64", "media_type": data["mime_type"], "data": data["data"]}
+                })
+        return content
+
+    def build_request(self, prompt_parts, history=None):
+        messages = [{"role": "assistant" if turn["role"] == "model" else "user", "content": self._content(turn["parts"])}
+                    for turn in history or []]
+        messages.append({"role": "user", "content": self._content(prompt_parts)})
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+        }
+        payload = {
+            "model": self.model,
+            "max_tokens": 1024,
+            "messages": messages,
+        }
+        return self.api_url, headers, payload
+
+    def parse_response(self, data):
+        blocks = data.get("content")
+        if not blocks:
+            logger.warning(f"No content found in response: {data}")
+            return "No response content received from AI."
+        text = "".join(block.get("text", "") for block in blocks if block.get("type") == "text")
+        if not text:
+            text = "No feedback received from the AI."
+        return text.strip()
+
+
+def providers_from_env(api_key=None, api_url=None):
+    """
+    Build the list of configured providers in preference order.
+
+    Gemini uses the existing VISION_API_KEY / VISION_API_URL settings. OpenAI and
+    Anthropic are added when OPENAI_API_KEY / ANTHROPIC_API_KEY are set. The order
+    comes from VISION_PROVIDER_ORDER (default "gemini,openai,anthropic").
+    """
+    timeout = float(os.getenv('VISION_API_TIMEOUT', '45'))
+    available = {}
+    if api_key and api_url:
+        available['gemini'] = GeminiProvider(api_key, api_url, timeout=timeout)
+    if os.getenv('OPENAI_API_KEY'):
+        available['openai'] = OpenAIProvider(
+            os.getenv('OPENAI_API_KEY'), os.getenv('OPENAI_VISION_MODEL', 'gpt-4o-mini'), timeout=timeout
+        )
+    if os.getenv('ANTHROPIC_API_KEY'):
+        available['anthropic'] = AnthropicProvider(
+            os.getenv('ANTHROPIC_API_KEY'), os.getenv('ANTHROPIC_VISION_MODEL', 'claude-3-5-haiku-latest'), timeout=timeout
+        )
+    order = [name.strip() for name in os.getenv('VISION_PROVIDER_ORDER', 'gemini,openai,anthropic').split(',')]
+    providers = [available[name] for name in order if name in available]
+    # Keep any configured provider that was left out of the order list as a last resort
+    providers += [p for name, p in available.items() if name not in order]
+    return providers
+
+
+class ProviderRouter:
+    """
+    Routes each call to the fastest healthy provider, within a preference order.
+
+    Latency is tracked per provider/model and call type. A provider that fails
+    `max_failures` times in a row is taken out of rotation for `cooldown` seconds.
+    A less preferred provider only takes over when its median latency beats the
+    current choice by more than `switch_margin`, and the most preferred healthy
+    provider is re-probed every `probe_interval` seconds so it can win back traffic.
+    Alternatives are only called on failover otherwise, so a share `explore_share`
+    of calls goes to an alternative that has not been used for `probe_interval`
+    seconds; that keeps a latency sample for every provider, and a preferred
+    provider that is slow without failing can still be overtaken.
+    """
+
+    def __init__(self, providers, max_failures=3, cooldown=30, switch_margin=0.2, probe_interval=60, window=50,
+                 explore_share=0.05):
+        self.providers = list(providers)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+        self.switch_margin = switch_margin
+        self.probe_interval = probe_interval
+        self.explore_share = explore_share
+        self.explorations = 0
+        self.tracker = LatencyTracker(window=window)
+        self._failures = {}
+        self._tripped_until = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def stats_key(self, provider, call_type):
+        return f"{provider.key}:{call_type}"
+
+    def is_healthy(self, provider):
+        with self._lock:
+            return time.time() >= self._tripped_until.get(provider.key, 0)
+
+    def candidates(self, call_type):
+        """Return providers to try for a call, best first, followed by fallbacks."""
+        healthy = [p for p in self.providers if self.is_healthy(p)]
+        tripped = [p for p in self.providers if p not in healthy]
+        if not healthy:
+            return tripped
+
+        preferred = healthy[0]
+        best = preferred
+        now = time.time()
+        with self._lock:
+            probe_due = now - self._last_used.get(preferred.key, 0) >= self.probe_interval
+            stale = [p for p in healthy[1:] if now - self._last_used.get(p.key, 0) >= self.probe_interval]
+            explore = not probe_due and stale and random.random() < self.explore_share
+            if explore:
+                self.explorations += 1
+        if explore:
+            # The preferred provider stays next in line, so a failed exploration still gets answered
+            best = stale[0]
+            logger.debug(f"Exploring {best.key} for '{call_type}' to refresh its latency")
+        elif not probe_due:
+            best_p50 = self.tracker.percentile(self.stats_key(best, call_type), 50)
+            for provider in healthy[1:]:
+                p50 = self.tracker.percentile(self.stats_key(provider, call_type), 50)
+                if best_p50 is not None and p50 is not None and p50 < best_p50 * (1 - self.switch_margin):
+                    best, best_p50 = provider, p50
+        return [best] + [p for p in healthy if p is not best] + tripped
+
+    def record(self, provider, call_type, seconds, ok):
+        """Record the outcome of one call and update the provider's health."""
+        self.tracker.record(self.stats_key(provider, call_type), seconds, ok=ok)
+        with self._lock:
+            self._last_used[provider.key] = time.time()
+            if ok:
+                self._failures[provider.key] = 0
+                return
+            failures = self._failures.get(provider.key, 0) + 1
+            self._failures[provider.key] = failures
+            if failures >= self.max_failures:
+                self._tripped_until[provider.key] = time.time() + self.cooldown
+                self._failures[provider.key] = 0
+                logger.warning(f"Provider {provider.key} failed {failures} times in a row, "
+                               f"removing it from rotation for {self.cooldown}s")
+
+    def summary(self):
+        """Return per-provider health and per-call-type latency statistics."""
+        now = time.time()
+        latency = self.tracker.summary()
+        result = {}
+        for provider in self.providers:
+            with self._lock:
+                tripped_until = self._tripped_until.get(provider.key, 0)
+            result[provider.key] = {
+                'healthy': now >= tripped_until,
+                'calls': {key.split(':')[-1]: stats for key, stats in latency.items()
+                          if key.startswith(provider.key + ':')},
+            }
+        return result